@@ -1,7 +1,5 @@
 import streamlit as st
 from PIL import Image
-import os
-import tempfile
 import json
 from extracted_items import extract_grocery_items
 
@@ -15,17 +13,14 @@ uploaded_file = st.file_uploader("Choose a receipt image (JPEG/PNG)", type=["jpg
 
 if uploaded_file is not None:
     try:
-        # Save uploaded file to a temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            tmp_path = tmp_file.name
+        # Decode the upload once, in memory, and reuse it for display and OCR
+        image = Image.open(uploaded_file)
+        image.load()
         # Display the uploaded image
-        st.image(tmp_path, caption="Uploaded Receipt", use_container_width=True)
+        st.image(image, caption="Uploaded Receipt", use_container_width=True)
         # Extract items
         with st.spinner("Extracting items from receipt..."):
-            result = extract_grocery_items(tmp_path)
-        # Remove temp file
-        os.remove(tmp_path)
+            result = extract_grocery_items(image)
         # Show result
         if isinstance(result, list):
             if result:
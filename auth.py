@@ -0,0 +1,413 @@
+# auth.py
+#
+# API keys and per-key limits. Every key has a name (used in logs, metrics
+# and usage counters; the key itself is never stored in them), a token-bucket
+# rate limit and a limit on requests in flight. ApiKeyMiddleware checks both
+# from the request headers alone, so a bad key or an over-quota request is
+# answered before its upload is read.
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import metrics
+
+
+# --- Configuration ---
+# OCR_API_KEYS: comma-separated API keys, each optionally named as
+#   "name:key". Without this and OCR_API_KEYS_FILE the built-in key is used.
+# OCR_API_KEYS_FILE: JSON list of {"name", "key", "rate", "burst",
+#   "concurrency"} objects; "sha256" (hex digest of the key) may be given
+#   instead of "key" so the file holds no secrets. Limits left out use the
+#   defaults below.
+# OCR_KEY_RATE: requests per minute allowed per key (0 = unlimited).
+# OCR_KEY_BURST: requests a key may make at once after being idle.
+# OCR_KEY_CONCURRENCY: requests per key in progress at once (0 = unlimited).
+# OCR_KEY_DB: sqlite file holding the limiter state and usage counters, so
+#   every worker process shares them. Empty keeps them in each process's
+#   memory (limits then apply per process).
+OCR_API_KEYS = os.environ.get("OCR_API_KEYS", "")
+OCR_API_KEYS_FILE = os.environ.get("OCR_API_KEYS_FILE", "")
+OCR_KEY_RATE = float(os.environ.get("OCR_KEY_RATE", 0))
+OCR_KEY_BURST = float(os.environ.get("OCR_KEY_BURST", 10))
+OCR_KEY_CONCURRENCY = int(os.environ.get("OCR_KEY_CONCURRENCY", 0))
+OCR_KEY_DB = os.environ.get("OCR_KEY_DB", "")
+
+API_KEY_HEADER = b"ocr-api"
+# Paths that need a key; everything else (health checks, docs, /metrics) is open.
+PROTECTED_PREFIXES = ("/v1/", "/metrics/slowest")
+# Protected paths that do not count against a key's limits, so a client that
+# hit its quota can still see its usage.
+UNMETERED_PATHS = ("/v1/usage",)
+# Usage counter names, also the outcome label of the per-key request metric
+OUTCOMES = ("accepted", "rate_limited", "concurrency_limited")
+
+ApiKey = namedtuple("ApiKey", "name rate burst concurrency")
+
+logger = logging.getLogger("ocr.auth")
+
+
+def _digest(key):
+    return hashlib.sha256(key.encode()).digest()
+
+
+class KeyRing:
+    """The known API keys, looked up by the SHA-256 digest of the presented key."""
+
+    def __init__(self, entries):
+        self._keys = {}  # digest -> (digest, ApiKey)
+        for entry in entries:
+            digest = bytes.fromhex(entry["sha256"]) if "sha256" in entry else _digest(entry["key"])
+            key = ApiKey(
+                entry.get("name") or digest.hex()[:8],
+                float(entry.get("rate", OCR_KEY_RATE)),
+                float(entry.get("burst", OCR_KEY_BURST)),
+                int(entry.get("concurrency", OCR_KEY_CONCURRENCY)),
+            )
+            self._keys[digest] = (digest, key)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def lookup(self, presented):
+        """Returns the ApiKey for a presented key string, or None."""
+        if not presented:
+            return None
+        digest = _digest(presented)
+        # The dict lookup only ever compares digests, which tell an attacker
+        # nothing about the key; the final check is constant-time regardless.
+        found = self._keys.get(digest)
+        if found is None or not hmac.compare_digest(found[0], digest):
+            return None
+        return found[1]
+
+
+def load_keyring(default_key, keys=OCR_API_KEYS, path=OCR_API_KEYS_FILE):
+    """Builds the KeyRing from OCR_API_KEYS and OCR_API_KEYS_FILE, or the default key if neither is set."""
+    entries = []
+    for item in filter(None, (k.strip() for k in keys.split(","))):
+        name, _, key = item.rpartition(":")
+        entries.append({"name": name, "key": key})
+    if path:
+        with open(path, encoding="utf-8") as f:
+            entries.extend(json.load(f))
+    if not entries:
+        entries.append({"name": "default", "key": default_key})
+    return KeyRing(entries)
+
+
+# ==============================================================================
+# Limiter stores
+# ==============================================================================
+# Both stores implement:
+#   acquire(key) -> None if the request may go ahead (and is now counted as in
+#       flight), else (outcome, retry_after_seconds)
+#   release(key) -> ends a request that acquire() let through
+#   usage(name)  -> {"accepted": n, "rate_limited": n, "concurrency_limited": n, "in_flight": n}
+
+def _take_token(tokens, updated, now, key):
+    """
+    Token-bucket step. Returns (tokens, retry_after): the bucket after
+    refilling and taking one token, with retry_after None; or, if no token
+    is available, the refilled bucket and the seconds until one is.
+    """
+    per_second = key.rate / 60
+    tokens = min(key.burst, tokens + (now - updated) * per_second)
+    if tokens >= 1:
+        return tokens - 1, None
+    return tokens, math.ceil((1 - tokens) / per_second)
+
+
+class MemoryLimiter:
+    """Limiter state and usage counters in this process's memory."""
+
+    blocking = False
+
+    def __init__(self):
+        self._buckets = {}  # name -> [tokens, updated]
+        self._in_flight = {}
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name, outcome):
+        counts = self._usage.setdefault(name, dict.fromkeys(OUTCOMES, 0))
+        counts[outcome] += 1
+
+    def acquire(self, key):
+        with self._lock:
+            if key.concurrency and self._in_flight.get(key.name, 0) >= key.concurrency:
+                self._count(key.name, "concurrency_limited")
+                return "concurrency_limited", 1
+            if key.rate:
+                now = time.monotonic()
+                bucket = self._buckets.setdefault(key.name, [key.burst, now])
+                tokens, retry_after = _take_token(bucket[0], bucket[1], now, key)
+                bucket[:] = [tokens, now]
+                if retry_after is not None:
+                    self._count(key.name, "rate_limited")
+                    return "rate_limited", retry_after
+            self._in_flight[key.name] = self._in_flight.get(key.name, 0) + 1
+            self._count(key.name, "accepted")
+            return None
+
+    def release(self, key):
+        with self._lock:
+            self._in_flight[key.name] -= 1
+
+    def usage(self, name):
+        with self._lock:
+            counts = dict(self._usage.get(name) or dict.fromkeys(OUTCOMES, 0))
+            counts["in_flight"] = self._in_flight.get(name, 0)
+            return counts
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS key_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS key_in_flight (
+    name TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (name, pid, started)
+);
+CREATE TABLE IF NOT EXISTS key_usage (
+    name TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (name, outcome)
+);
+"""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _process_started(pid):
+    """
+    Identifies one run of process `pid`: the boot id and the process start
+    time from /proc, so a pid reused after a restart (common in containers,
+    where workers get the same low pids every time) does not match. Returns
+    None if there is no such process. Without /proc any live pid gives "".
+    """
+    try:
+        boot_id = _read("/proc/sys/kernel/random/boot_id").strip().decode()
+    except OSError:
+        return "" if _pid_alive(pid) else None
+    try:
+        stat = _read(f"/proc/{pid}/stat")
+    except OSError:
+        return None
+    # Field 22 is the start time; the command name (field 2) may contain spaces
+    return f"{boot_id}:{stat.rpartition(b')')[2].split()[19].decode()}"
+
+
+class SqliteLimiter:
+    """
+    Limiter state and usage counters in a sqlite file shared by every
+    process on the machine. Requests in flight are counted per process (pid
+    and start time), so the counts of a process that died can be dropped.
+    """
+
+    blocking = True
+
+    def __init__(self, path=OCR_KEY_DB):
+        self.path = path
+        self._local = threading.local()
+        # Created with a throwaway connection: the server may fork after
+        # this, and sqlite connections must not be shared with a child.
+        db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            columns = [row[1] for row in db.execute("PRAGMA table_info(key_in_flight)")]
+            if columns and "started" not in columns:
+                # In-flight counts from before processes were told apart by start time
+                db.execute("DROP TABLE key_in_flight")
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.db, self._local.pid = db, os.getpid()
+            self._local.started = _process_started(os.getpid())
+            self._drop_dead_processes(db)
+        return db
+
+    @staticmethod
+    def _drop_dead_processes(db):
+        rows = db.execute("SELECT DISTINCT pid, started FROM key_in_flight").fetchall()
+        for pid, started in rows:
+            if _process_started(pid) != started:
+                db.execute("DELETE FROM key_in_flight WHERE pid = ? AND started = ?", (pid, started))
+
+    @staticmethod
+    def _count(db, name, outcome):
+        db.execute(
+            "INSERT INTO key_usage (name, outcome, n) VALUES (?, ?, 1)"
+            " ON CONFLICT (name, outcome) DO UPDATE SET n = n + 1",
+            (name, outcome),
+        )
+
+    def acquire(self, key):
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = self._acquire(db, key)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _acquire(self, db, key):
+        if key.concurrency:
+            (in_flight,) = db.execute(
+                "SELECT COALESCE(SUM(n), 0) FROM key_in_flight WHERE name = ?", (key.name,)
+            ).fetchone()
+            if in_flight >= key.concurrency:
+                self._count(db, key.name, "concurrency_limited")
+                return "concurrency_limited", 1
+        if key.rate:
+            # Wall-clock time, since the monotonic clock is not shared between processes
+            now = time.time()
+            row = db.execute("SELECT tokens, updated FROM key_buckets WHERE name = ?", (key.name,)).fetchone()
+            tokens, retry_after = _take_token(*(row or (key.burst, now)), now, key)
+            db.execute(
+                "INSERT INTO key_buckets (name, tokens, updated) VALUES (?, ?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key.name, tokens, now),
+            )
+            if retry_after is not None:
+                self._count(db, key.name, "rate_limited")
+                return "rate_limited", retry_after
+        db.execute(
+            "INSERT INTO key_in_flight (name, pid, started, n) VALUES (?, ?, ?, 1)"
+            " ON CONFLICT (name, pid, started) DO UPDATE SET n = n + 1",
+            (key.name, os.getpid(), self._local.started),
+        )
+        self._count(db, key.name, "accepted")
+        return None
+
+    def release(self, key):
+        self._connect().execute(
+            "UPDATE key_in_flight SET n = n - 1 WHERE name = ? AND pid = ? AND started = ?",
+            (key.name, os.getpid(), self._local.started),
+        )
+
+    def usage(self, name):
+        db = self._connect()
+        counts = dict.fromkeys(OUTCOMES, 0)
+        counts.update(db.execute("SELECT outcome, n FROM key_usage WHERE name = ?", (name,)).fetchall())
+        (counts["in_flight"],) = db.execute(
+            "SELECT COALESCE(SUM(n), 0) FROM key_in_flight WHERE name = ?", (name,)
+        ).fetchone()
+        return counts
+
+
+def create_limiter(path=OCR_KEY_DB):
+    return SqliteLimiter(path) if path else MemoryLimiter()
+
+
+# ==============================================================================
+# Middleware
+# ==============================================================================
+class ApiKeyMiddleware:
+    """
+    ASGI middleware authenticating requests to PROTECTED_PREFIXES by their
+    ocr-api header and applying the key's limits. Runs before FastAPI reads
+    (and spools) the request body, so rejected uploads cost almost nothing.
+    The matched ApiKey is left in the request state as `api_key`.
+    """
+
+    def __init__(self, app, keyring, limiter, prefixes=PROTECTED_PREFIXES):
+        self.app = app
+        self.keyring = keyring
+        self.limiter = limiter
+        self.prefixes = prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        presented = None
+        for name, value in scope["headers"]:
+            if name == API_KEY_HEADER:
+                presented = value.decode("latin-1")
+                break
+        key = self.keyring.lookup(presented)
+        if key is None:
+            await _reject(send, 403, "Could not validate credentials")
+            return
+        scope.setdefault("state", {})["api_key"] = key
+        if scope["path"] in UNMETERED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if self.limiter.blocking:
+            rejected = await asyncio.to_thread(self.limiter.acquire, key)
+        else:
+            rejected = self.limiter.acquire(key)
+        if rejected is not None:
+            outcome, retry_after = rejected
+            metrics.count_key(key.name, outcome)
+            detail = (
+                "Too many requests for this API key; retry later." if outcome == "rate_limited"
+                else "Too many requests in progress for this API key; retry later."
+            )
+            await _reject(send, 429, detail, retry_after)
+            return
+
+        metrics.count_key(key.name, "accepted")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if self.limiter.blocking:
+                # Shielded: the slot has to be given back even when the
+                # request is cancelled while waiting for the thread
+                await asyncio.shield(asyncio.to_thread(self._release, key))
+            else:
+                self._release(key)
+
+    def _release(self, key):
+        # An error here must not replace the response (or the exception)
+        # of the request itself
+        try:
+            self.limiter.release(key)
+        except Exception:
+            logger.exception("Could not release an in-flight request of key %s", key.name)
+
+
+async def _reject(send, status, detail, retry_after=None):
+    body = json.dumps({"detail": detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
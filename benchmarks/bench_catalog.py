@@ -0,0 +1,130 @@
+# bench_catalog.py
+#
+# Build time, load time and lookup latency of the product catalog index on a
+# synthetic catalog.
+#
+#   python benchmarks/bench_catalog.py                   # 100k products
+#   python benchmarks/bench_catalog.py --products 500000
+#
+# Product names are built like a supermarket's ("Hillside Organic Whole
+# Milk 2L"), from a small shared vocabulary of brands, descriptors, products
+# and sizes, so common words and trigrams appear in thousands of names.
+# Lookups use misspelled product names (a letter dropped, doubled or
+# swapped), like the names OCR produces, and report how many found the
+# product they were made from. Misspelled names of products left out of the
+# catalog report how many were wrongly renamed to another product.
+
+import argparse
+import csv
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from catalog import load_catalog  # noqa: E402
+
+UNITS = ["kg", "g", "l", "ml", "each", ""]
+BRANDS = (
+    "Hillside Greenfield Sunvale Oakridge Riverbend Meadowbrook Harvest Goldcrest Bluewater Northfarm "
+    "Country Valley Morning Fresh Silverleaf Redbarn Stonegate Willowby Clearspring Fairacre Highland "
+    "Brookside Maple Lane Sunrise Cedar Grove Pinecrest Homestead Orchard Lakeside Westcliff Kingsmead"
+).split()
+DESCRIPTORS = (
+    "organic fresh frozen whole skimmed light smoked unsalted salted sweet spicy mild mature "
+    "wholegrain sliced diced baby large free range lean extra virgin natural greek classic "
+    "roasted dried ripe seedless low fat reduced sugar plain"
+).split()
+PRODUCTS = (
+    "milk butter cheddar mozzarella yogurt cream eggs bread bagels croissants rolls tortillas "
+    "apples bananas oranges lemons limes grapes strawberries blueberries raspberries pears peaches "
+    "mango pineapple avocado tomatoes potatoes onions garlic carrots broccoli cauliflower spinach "
+    "lettuce cucumber zucchini peppers mushrooms celery cabbage kale beans peas corn rice pasta "
+    "spaghetti noodles oats cereal granola flour sugar honey jam peanut almonds walnuts cashews "
+    "chicken beef pork lamb turkey bacon ham sausages salmon tuna cod prawns coffee tea juice "
+    "water cola lemonade chocolate biscuits crackers crisps popcorn soup ketchup mayonnaise "
+    "mustard vinegar oil salsa hummus tofu lentils chickpeas quinoa couscous olives pickles"
+).split()
+SIZES = ["500g", "1kg", "250g", "2l", "1l", "500ml", "6pk", "12pk", "400g", "750ml"]
+
+
+def synthetic_catalog(rng, n_products):
+    """
+    Product names like a supermarket's: brand, up to two descriptors, one or
+    two products and a pack size, drawn from shared word lists.
+    """
+    names = set()
+    while len(names) < n_products:
+        words = [rng.choice(BRANDS)]
+        words += rng.sample(DESCRIPTORS, rng.randint(0, 2))
+        words += rng.sample(PRODUCTS, rng.choice((1, 1, 1, 2)))
+        if rng.random() < 0.7:
+            words.append(rng.choice(SIZES))
+        names.add(" ".join(words).title())
+    return [(name, rng.choice(UNITS)) for name in sorted(names)]
+
+
+def misspell(rng, name):
+    i = rng.randrange(len(name))
+    edit = rng.choice(("drop", "double", "swap"))
+    if edit == "drop":
+        return name[:i] + name[i + 1:]
+    if edit == "double":
+        return name[:i] + name[i] + name[i:]
+    j = min(i + 1, len(name) - 1)
+    return name[:i] + name[j] + name[i] + name[j + 1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the product catalog index.")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    products = synthetic_catalog(rng, args.products + args.lookups)
+    rng.shuffle(products)
+    # Products the catalog does not know, for counting wrong matches
+    products, unknown = products[:args.products], products[args.products:]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["name", "unit"])
+            writer.writerows(products)
+
+        t0 = time.perf_counter()
+        load_catalog(path)
+        build_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        catalog = load_catalog(path)
+        load_s = time.perf_counter() - t0
+
+    queries = [rng.choice(products)[0] for _ in range(args.lookups)]
+    queries = [(name, misspell(rng, name)) for name in queries]
+    latencies = []
+    found = 0
+    for name, query in queries:
+        t0 = time.perf_counter()
+        match = catalog._match(query)  # uncached
+        latencies.append(time.perf_counter() - t0)
+        found += match is not None and match.name == name
+    latencies.sort()
+    wrong = sum(catalog._match(misspell(rng, name)) is not None for name, _ in unknown)
+
+    print(f"products:     {len(catalog)}")
+    print(f"build:        {build_s:.2f}s")
+    print(f"load:         {load_s * 1000:.1f}ms (pickled index)")
+    print(f"lookup p50:   {statistics.median(latencies) * 1e6:.0f}us")
+    print(f"lookup p99:   {latencies[int(len(latencies) * 0.99)] * 1e6:.0f}us")
+    print(f"found:        {found}/{len(queries)} misspelled names")
+    print(f"wrong:        {wrong}/{len(unknown)} misspelled unknown names matched a product")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# bench_extract.py
+#
+# End-to-end extraction benchmark on the synthetic corpus (see corpus.py):
+#
+#   1. per-stage timings (decode, preprocessing stages, OCR, parse)
+#   2. throughput and p50/p95/p99 latency of extract_grocery_items called from
+#      --concurrency threads
+#   3. the same for the FastAPI app, driven in-process through an ASGI client
+#
+#   python benchmarks/bench_extract.py --receipts 20 --concurrency 4
+#   python benchmarks/bench_extract.py --skip-api --preprocess none
+#
+# Needs a working Tesseract (binary or tesserocr) and, for the API part,
+# httpx. The API part sends "ocr-cache: bypass" so every request runs OCR.
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402  (also puts the repo root on sys.path)
+from extracted_items import extract_grocery_items, extract_grocery_items_timed  # noqa: E402
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return float("nan")
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def report(label, latencies, wall):
+    latencies = sorted(latencies)
+    print(
+        f"{label:<10} {len(latencies):>6} {len(latencies) / wall:>8.1f}/s"
+        f" {percentile(latencies, 50) * 1000:>8.1f}ms {percentile(latencies, 95) * 1000:>8.1f}ms"
+        f" {percentile(latencies, 99) * 1000:>8.1f}ms"
+    )
+
+
+def bench_stages(receipts, preprocess):
+    """Runs each receipt once, single-threaded, and prints per-stage percentiles."""
+    stages = {}
+    precision, recall = [], []
+    for receipt in receipts:
+        result, timings, _ = extract_grocery_items_timed(receipt["image"], preprocess)
+        for stage, ms in timings.items():
+            stages.setdefault(stage, []).append(ms)
+        p, r = corpus.item_accuracy(receipt["items"], result)
+        precision.append(p)
+        recall.append(r)
+
+    print(f"{'stage':<18} {'mean':>9} {'p50':>9} {'p95':>9}")
+    for stage, samples in stages.items():
+        samples.sort()
+        print(
+            f"{stage[:-3]:<18} {statistics.mean(samples):>7.1f}ms"
+            f" {percentile(samples, 50):>7.1f}ms {percentile(samples, 95):>7.1f}ms"
+        )
+    print(f"item precision {statistics.mean(precision):.3f}, recall {statistics.mean(recall):.3f}")
+
+
+def bench_function(receipts, preprocess, concurrency, rounds):
+    images = [r["image"] for r in receipts] * rounds
+
+    def timed(image):
+        t0 = time.perf_counter()
+        extract_grocery_items(image, preprocess)
+        return time.perf_counter() - t0
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        # One untimed call per thread so engine start-up is not measured
+        list(pool.map(timed, images[:concurrency]))
+        t0 = time.perf_counter()
+        latencies = list(pool.map(timed, images))
+        wall = time.perf_counter() - t0
+    report("function", latencies, wall)
+
+
+async def bench_api(receipts, preprocess, concurrency, rounds):
+    import httpx
+    import main
+
+    headers = {main.API_KEY_NAME: main.API_KEY, main.CACHE_HEADER_NAME: "bypass"}
+    params = {"preprocess": preprocess} if preprocess is not None else {}
+    images = [r["image"] for r in receipts] * rounds
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+            async def post(image):
+                async with semaphore:
+                    t0 = time.perf_counter()
+                    resp = await client.post(
+                        "/v1/extract_items", headers=headers, params=params,
+                        files={"image": ("receipt.png", image, "image/png")},
+                    )
+                    return time.perf_counter() - t0, resp.status_code
+
+            await asyncio.gather(*(post(image) for image in images[:concurrency]))
+            t0 = time.perf_counter()
+            results = await asyncio.gather(*(post(image) for image in images))
+            wall = time.perf_counter() - t0
+
+    errors = sum(1 for _, status in results if status != 200)
+    report("api", [latency for latency, _ in results], wall)
+    if errors:
+        print(f"api: {errors} of {len(results)} requests failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image extraction on the synthetic corpus.")
+    parser.add_argument("--receipts", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--scale", type=float, default=1.0, help="upscale factor for the rendered receipts")
+    parser.add_argument("--preprocess", help="preprocessing stages, e.g. 'none' or 'resize,grayscale'")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the corpus for the load tests")
+    parser.add_argument("--skip-api", action="store_true", help="do not benchmark the FastAPI app")
+    args = parser.parse_args()
+
+    receipts = list(corpus.generate(args.receipts, args.seed, scale=args.scale))
+    print(f"{len(receipts)} receipts, concurrency {args.concurrency}\n")
+    bench_stages(receipts, args.preprocess)
+    print(f"\n{'':<10} {'calls':>6} {'rate':>10} {'p50':>10} {'p95':>10} {'p99':>10}")
+    bench_function(receipts, args.preprocess, args.concurrency, args.rounds)
+    if not args.skip_api:
+        asyncio.run(bench_api(receipts, args.preprocess, args.concurrency, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# bench_ocr_engine.py
+#
+# Compares the OCR engines in extracted_items.py on the same rendered receipt:
+# per-image latency and resident memory over many calls.
+#
+#   python benchmarks/bench_ocr_engine.py --calls 1000
+#
+# Engines that are not usable here (no tesseract binary, tesserocr not
+# installed) are skipped. Set TESSDATA_PREFIX if the language data lives
+# somewhere non-standard.
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402  (also puts the repo root on sys.path)
+import extracted_items  # noqa: E402
+
+LINES = [
+    "FRESH MART", "BANANAS 1.99", "0.778 kg", "WHOLE MILK 2 3.49",
+    "FREE RANGE EGGS 1", "SOURDOUGH BREAD 4.50", "TOTAL 9.98",
+]
+
+
+def rss_mb():
+    """Current resident set size of this process, in MB (Linux only)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def make_engine(name):
+    try:
+        if name == "pytesseract":
+            import pytesseract
+            pytesseract.get_tesseract_version()
+            return extracted_items.PytesseractEngine()
+        if extracted_items.tesserocr is None:
+            return None
+        return extracted_items.TesserocrEngine()
+    except Exception as e:
+        print(f"{name}: skipped ({e})")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare OCR engine latency and memory.")
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    img = corpus.render(LINES)
+    print(f"{'engine':<12} {'first':>9} {'mean':>9} {'p50':>9} {'p95':>9} {'rss start':>10} {'rss end':>9}")
+    for name in ("pytesseract", "tesserocr"):
+        t0 = time.perf_counter()
+        engine = make_engine(name)
+        if engine is None:
+            continue
+        engine.image_to_string(img)
+        first = time.perf_counter() - t0
+
+        # Let allocator pools settle before taking the baseline
+        for _ in range(5):
+            engine.image_to_string(img)
+        rss_start = rss_mb()
+        samples = []
+        for _ in range(args.calls):
+            t0 = time.perf_counter()
+            engine.image_to_string(img)
+            samples.append(time.perf_counter() - t0)
+        rss_end = rss_mb()
+        engine.close()
+
+        samples.sort()
+        print(
+            f"{name:<12} {first * 1000:>7.1f}ms {statistics.mean(samples) * 1000:>7.1f}ms"
+            f" {samples[len(samples) // 2] * 1000:>7.1f}ms {samples[int(len(samples) * 0.95)] * 1000:>7.1f}ms"
+            f" {rss_start:>8.1f}MB {rss_end:>7.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# bench_parser.py
+#
+# Micro-benchmark for the receipt text parser (no OCR involved).
+#
+#   python benchmarks/bench_parser.py                    # current tree only
+#   python benchmarks/bench_parser.py --baseline HEAD~1  # compare with a git revision
+#
+# With --baseline, the parser from that revision is loaded from git, run on
+# the same synthetic receipts, and its output is checked to be identical.
+
+import argparse
+import importlib.util
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import timeit
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+ITEM_WORDS = [
+    "bananas", "whole", "milk", "zuchinni", "green", "free", "range", "eggs", "flour",
+    "olive", "oil", "chicken", "breast", "sourdough", "bread", "basmati", "rice",
+    "orange", "juice", "cheddar", "cheese", "greek", "yogurt", "spinach", "tomatoes",
+]
+NOISE_LINES = [
+    "FRESH MART SUPERSTORE", "123 Main Street", "Tel 555-0100", "Cashier: Sam",
+    "SUBTOTAL 45.20", "TAX 2.10", "TOTAL 47.30", "CASH 50.00", "CHANGE 2.70",
+    "Thank you for shopping with us", "Date 12/03/2024 Time 14:32",
+]
+
+
+def synthetic_receipt(rng, n_lines):
+    """Receipt text mixing every line format the parser knows with header/footer noise."""
+    def name():
+        return " ".join(rng.choice(ITEM_WORDS) for _ in range(rng.randint(1, 3))).upper()
+
+    lines = []
+    while len(lines) < n_lines:
+        kind = rng.randrange(8)
+        if kind == 0:
+            lines += [f"{name()} {rng.uniform(0.5, 20):.2f}", f"{rng.uniform(0.1, 3):.3f} kg"]
+        elif kind == 1:
+            lines.append(f"{name()} {rng.randint(1, 6)} {rng.uniform(0.5, 20):.2f}")
+        elif kind == 2:
+            lines.append(f"{name()} {rng.uniform(0.1, 3):.3f} {rng.choice(['kg', 'g', 'lbs', 'pcs'])}")
+        elif kind == 3:
+            lines.append(f"{name()} {rng.randint(1, 12)}")
+        elif kind == 4:
+            lines += [name(), f"Quantity: {rng.randint(1, 4)} x {rng.uniform(0.5, 5):.2f} kg"]
+        elif kind == 5:
+            lines.append(f"{rng.randint(1, 5)}kg {name()}")
+        elif kind == 6:
+            lines.append(name())
+        else:
+            lines.append(rng.choice(NOISE_LINES))
+    return "\n".join(lines[:n_lines])
+
+
+def load_module_from_git(rev, path="extracted_items.py"):
+    """Imports `path` as it was at git revision `rev`."""
+    source = subprocess.run(
+        ["git", "show", f"{rev}:{path}"], cwd=REPO_ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = os.path.join(tmp, "baseline_extracted_items.py")
+        with open(file_path, "w") as f:
+            f.write(source)
+        spec = importlib.util.spec_from_file_location("baseline_extracted_items", file_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+def text_parser(module):
+    """Returns a function text -> parse result for any version of extracted_items."""
+    for name in ("parse_receipt_text", "_parse_lines"):
+        fn = getattr(module, name, None)
+        if fn is not None:
+            if name == "_parse_lines":
+                return lambda text: fn(text.split("\n"))
+            return fn
+
+    # Older versions only parse inside extract_grocery_items: stub out the OCR
+    module.Image = types.SimpleNamespace(open=lambda path: None)
+    current = {}
+    module.pytesseract.image_to_string = lambda img: current["text"]
+
+    def parse(text):
+        current["text"] = text
+        return module.extract_grocery_items("receipt")
+    return parse
+
+
+def bench(parse, texts, repeat):
+    timer = timeit.Timer(lambda: [parse(t) for t in texts])
+    best = min(timer.repeat(repeat=repeat, number=1))
+    return best / len(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark for the receipt text parser.")
+    parser.add_argument("--baseline", help="git revision to compare against, e.g. HEAD~1")
+    parser.add_argument("--receipts", type=int, default=200, help="receipts per size")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    import extracted_items
+    current = text_parser(extracted_items)
+    baseline = text_parser(load_module_from_git(args.baseline)) if args.baseline else None
+
+    rng = random.Random(args.seed)
+    print(f"{'lines':>6} {'current':>12} {'baseline':>12} {'speedup':>8}")
+    for n_lines in (20, 100, 500):
+        texts = [synthetic_receipt(rng, n_lines) for _ in range(args.receipts)]
+        if baseline is not None:
+            mismatches = sum(1 for t in texts if current(t) != baseline(t))
+            if mismatches:
+                sys.exit(f"{mismatches} of {len(texts)} receipts parse differently from {args.baseline}")
+        t_cur = bench(current, texts, args.repeat)
+        if baseline is None:
+            print(f"{n_lines:>6} {t_cur * 1e6:>10.1f}us")
+        else:
+            t_base = bench(baseline, texts, args.repeat)
+            print(f"{n_lines:>6} {t_cur * 1e6:>10.1f}us {t_base * 1e6:>10.1f}us {t_base / t_cur:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
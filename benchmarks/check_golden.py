@@ -0,0 +1,101 @@
+# check_golden.py
+#
+# Guards parsing results against accidental changes. Receipt texts and the
+# items they parsed to are stored under benchmarks/golden/; this script parses
+# them again and exits non-zero if any result differs.
+#
+#   python benchmarks/check_golden.py            # check the parser
+#   python benchmarks/check_golden.py --ocr      # also check full image extraction
+#   python benchmarks/check_golden.py --update   # accept the current output
+#
+# parse_golden.json only depends on the parser, so it should pass anywhere.
+# ocr_golden.json holds extract_grocery_items output for the rendered corpus
+# images, which depends on the installed Tesseract version and language data;
+# regenerate it with --ocr --update after changing either on purpose.
+
+import argparse
+import json
+import os
+import random
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import corpus  # noqa: E402  (also puts the repo root on sys.path)
+from bench_parser import synthetic_receipt  # noqa: E402
+from extracted_items import extract_grocery_items, parse_receipt_text  # noqa: E402
+
+GOLDEN_DIR = os.path.join(BENCH_DIR, "golden")
+PARSE_GOLDEN = os.path.join(GOLDEN_DIR, "parse_golden.json")
+OCR_GOLDEN = os.path.join(GOLDEN_DIR, "ocr_golden.json")
+
+SEED = 1234
+CORPUS_RECEIPTS = 20
+# Extra texts covering line formats the corpus does not use
+MIXED_RECEIPTS = 30
+
+
+def parse_cases():
+    """Texts for the parser check: the corpus receipts plus mixed-format ones."""
+    cases = [{"name": r["name"], "text": r["text"]} for r in corpus.generate(CORPUS_RECEIPTS, SEED)]
+    rng = random.Random(SEED)
+    for i in range(MIXED_RECEIPTS):
+        cases.append({"name": f"mixed_{i:03d}", "text": synthetic_receipt(rng, rng.randint(5, 60))})
+    return cases
+
+
+def check(path, cases, run, update):
+    """
+    Runs `run` on every case and compares with the stored output.
+    Returns the number of mismatches (always 0 with update=True).
+    """
+    if update:
+        for case in cases:
+            case["expected"] = run(case)
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump([{k: v for k, v in c.items() if k != "image"} for c in cases], f, indent=1)
+            f.write("\n")
+        print(f"Wrote {len(cases)} cases to {os.path.relpath(path, corpus.REPO_ROOT)}")
+        return 0
+
+    with open(path) as f:
+        stored = json.load(f)
+    inputs = {c["name"]: c for c in cases}
+    mismatches = 0
+    for golden in stored:
+        # JSON round trip so tuples, ints and floats compare like the stored data
+        actual = json.loads(json.dumps(run(inputs.get(golden["name"], golden))))
+        if actual != golden["expected"]:
+            mismatches += 1
+            print(f"MISMATCH {golden['name']}\n  expected: {golden['expected']}\n  actual:   {actual}")
+    print(f"{os.path.relpath(path, corpus.REPO_ROOT)}: {len(stored) - mismatches}/{len(stored)} match")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check parsing results against the stored golden outputs.")
+    parser.add_argument("--ocr", action="store_true", help="also check OCR on the rendered corpus images")
+    parser.add_argument("--update", action="store_true", help="overwrite the golden files with the current output")
+    args = parser.parse_args()
+
+    # Parse cases are checked against their stored text, so the check still
+    # holds if the corpus generator changes later.
+    if args.update:
+        cases = parse_cases()
+    else:
+        cases = []
+    failed = check(PARSE_GOLDEN, cases, lambda c: parse_receipt_text(c["text"]), args.update)
+
+    if args.ocr:
+        images = [
+            {"name": r["name"], "image": r["image"]} for r in corpus.generate(CORPUS_RECEIPTS, SEED)
+        ]
+        failed += check(OCR_GOLDEN, images, lambda c: extract_grocery_items(c["image"]), args.update)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# corpus.py
+#
+# Synthetic receipt corpus shared by the benchmarks and the golden check.
+# Everything is generated from a seed, so the same seed always gives the same
+# receipts, texts and images.
+#
+#   python benchmarks/corpus.py out_dir --count 50   # write PNG + JSON pairs
+#
+# Each receipt comes with its ground truth: the items a perfect OCR read of
+# the image should produce, in the same shape extract_grocery_items returns
+# (minus confidence).
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+
+from PIL import Image, ImageDraw, ImageFont
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from extracted_items import SKIP_RE, get_default_unit  # noqa: E402
+
+PRODUCTS = [
+    "bananas", "carrots", "whole milk", "free range eggs", "sourdough bread", "basmati rice",
+    "orange juice", "cheddar cheese", "greek yogurt", "tomatoes", "zucchini green",
+    "red onions", "chicken thighs", "ground beef", "olive oil", "penne pasta", "apples gala",
+    "broccoli", "cucumber", "garlic bulb", "ginger root", "avocado", "lemons", "strawberries",
+    "butter salted", "plain flour", "white sugar", "oat biscuits", "coffee beans", "green tea",
+    "pork chops", "salmon fillet", "mushrooms", "sweet potato", "baby potatoes", "kiwi fruit",
+    "frozen peas", "peanut butter", "tortilla wraps", "sparkling water", "dark chocolate",
+    "corn flakes", "canned tuna", "tomato sauce", "honey", "blueberries", "celery",
+    "lettuce iceberg", "yellow peppers",
+]
+# A product whose name contains a skip keyword would never be extracted
+assert not any(SKIP_RE.search(p) for p in PRODUCTS)
+
+WEIGHED_UNITS = ["kg", "g", "lbs"]
+
+HEADER_LINES = [
+    "WELCOME TO FRESH MART", "123 MAIN STREET", "TEL 555 0100", "DATE 12/03/2024",
+]
+FOOTER_TEMPLATES = [
+    "SUBTOTAL {total:.2f}", "TAX 0.00", "TOTAL {total:.2f}", "CASH {cash:.2f}",
+    "CHANGE {change:.2f}", "THANK YOU FOR SHOPPING",
+]
+
+
+def receipt_lines(rng, n_items):
+    """
+    Returns (lines, items) for one receipt. Items use the line formats the
+    parser understands, each with a distinct product.
+    """
+    lines = list(HEADER_LINES)
+    items = []
+    total = 0.0
+    kind = None
+    for product in rng.sample(PRODUCTS, n_items):
+        name = product.upper()
+        price = round(rng.uniform(0.5, 15), 2)
+        total += price
+        # A "name price" line takes a weight from the next line, so it is
+        # never followed by a line that carries its own weight.
+        kind = rng.choice([0, 2, 3] if kind == 3 else [0, 1, 2, 3])
+        if kind == 0:
+            # Name and price, weight on the next line
+            qty, unit = round(rng.uniform(0.1, 3), 3), rng.choice(WEIGHED_UNITS)
+            lines += [f"{name} {price:.2f}", f"{qty} {unit}"]
+        elif kind == 1:
+            # Name, weight and unit on one line
+            qty, unit = round(rng.uniform(0.1, 3), 3), rng.choice(WEIGHED_UNITS)
+            lines.append(f"{name} {qty} {unit}")
+        elif kind == 2:
+            # Name above a quantity line
+            qty, unit = rng.randint(2, 6), "kg"
+            lines += [name, f"Quantity: {qty} x {price:.2f} {unit}"]
+        else:
+            # Name and price only: quantity 1, unit guessed from the name
+            qty, unit = 1, get_default_unit(product)
+            lines.append(f"{name} {price:.2f}")
+        items.append({"item_name": product.title(), "quantity": qty, "unit": unit})
+    cash = float(int(total) + 5)
+    lines += [t.format(total=total, cash=cash, change=cash - total) for t in FOOTER_TEMPLATES]
+    return lines, items
+
+
+def render(lines, scale=1.0, font_size=28, line_height=48, margin=30):
+    """Renders receipt lines as black text on white, optionally upscaled like a phone photo."""
+    font = ImageFont.load_default(size=font_size)
+    width = max(int(font.getlength(line)) for line in lines) + 2 * margin
+    img = Image.new("L", (width, line_height * len(lines) + 2 * margin), 255)
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(lines):
+        draw.text((margin, margin + i * line_height), line, fill=0, font=font)
+    if scale != 1.0:
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.LANCZOS)
+    return img.convert("RGB")
+
+
+def generate(count=20, seed=1234, min_items=3, max_items=15, scale=1.0):
+    """
+    Yields `count` receipts as dicts: {"name", "text", "items", "image"}, where
+    image is PNG bytes.
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        lines, items = receipt_lines(rng, rng.randint(min_items, max_items))
+        buf = io.BytesIO()
+        render(lines, scale=scale).save(buf, "PNG")
+        yield {"name": f"receipt_{i:03d}", "text": "\n".join(lines), "items": items, "image": buf.getvalue()}
+
+
+def item_accuracy(expected, extracted):
+    """
+    Compares extracted items with ground truth by (name, quantity, unit).
+    Returns (precision, recall).
+    """
+    def key(item):
+        return (item["item_name"].lower(), round(float(item["quantity"]), 3), item["unit"])
+
+    want = {key(i) for i in expected}
+    got = {key(i) for i in extracted} if isinstance(extracted, list) else set()
+    hits = len(want & got)
+    precision = hits / len(got) if got else 0.0
+    recall = hits / len(want) if want else 1.0
+    return precision, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic receipt corpus to a directory.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--scale", type=float, default=1.0, help="upscale factor, e.g. 4 for phone-photo sizes")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for receipt in generate(args.count, args.seed, scale=args.scale):
+        with open(os.path.join(args.out_dir, receipt["name"] + ".png"), "wb") as f:
+            f.write(receipt["image"])
+        with open(os.path.join(args.out_dir, receipt["name"] + ".json"), "w") as f:
+            json.dump({"text": receipt["text"], "items": receipt["items"]}, f, indent=2)
+    print(f"Wrote {args.count} receipts to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
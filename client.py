@@ -0,0 +1,355 @@
+# client.py
+#
+# Python client for the receipt OCR API, with a blocking (OcrClient) and an
+# asyncio (AsyncOcrClient) interface. Both keep a pool of keep-alive
+# connections, limit the requests in flight, retry busy (429/503) responses
+# and connection errors with backoff, and can shrink images before upload.
+#
+#   with OcrClient("http://127.0.0.1:7860") as client:
+#       items = client.extract("receipt.jpg")
+#
+# As a command line tool it sends a whole directory of receipts through
+# /v1/extract_items and writes one JSON line per image:
+#
+#   python client.py receipts/ --out results.jsonl --concurrency 8 --max-width 1200
+#
+# To run against the app in-process (tests, notebooks), pass a transport:
+#
+#   import httpx, main
+#   client = AsyncOcrClient("http://app", transport=httpx.ASGITransport(app=main.app))
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from PIL import Image
+
+
+# --- Configuration ---
+# OCR_API_URL: server the client talks to.
+# OCR_API_KEY: value of the ocr-api header.
+OCR_API_URL = os.environ.get("OCR_API_URL", "http://127.0.0.1:7860")
+OCR_API_KEY = os.environ.get("OCR_API_KEY", "meallens@ocr")
+API_KEY_HEADER = "ocr-api"
+
+# Responses that mean "busy, try again later"
+RETRY_STATUSES = (429, 503)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class ApiError(Exception):
+    """The API answered with an error status (after any retries)."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+def prepare_image(data, max_width=None, jpeg_quality=None):
+    """
+    Shrinks encoded image bytes for upload. Images wider than max_width are
+    downscaled; with jpeg_quality they are re-encoded as JPEG at that
+    quality. Returns (data, content_type, scale), where scale is the new
+    width over the original (1.0 if the image was sent as is).
+    """
+    content_type = "image/png" if data[:8] == b"\x89PNG\r\n\x1a\n" else "image/jpeg"
+    if not max_width and not jpeg_quality:
+        return data, content_type, 1.0
+
+    try:
+        img = Image.open(io.BytesIO(data))
+    except Image.UnidentifiedImageError:
+        # Not an image we can read; let the server report what is wrong with it
+        return data, content_type, 1.0
+    scale = 1.0
+    if max_width and img.width > max_width:
+        scale = max_width / img.width
+        size = (max_width, round(img.height * scale))
+        if img.format == "JPEG":
+            # Let the decoder skip the detail we are about to throw away
+            img.draft(img.mode, size)
+        img = img.resize(size, Image.LANCZOS)
+    elif not jpeg_quality:
+        return data, content_type, 1.0
+
+    out = io.BytesIO()
+    if jpeg_quality or content_type == "image/jpeg":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(out, "JPEG", quality=jpeg_quality or 90, optimize=True)
+        content_type = "image/jpeg"
+    else:
+        img.save(out, "PNG", optimize=True)
+    return out.getvalue(), content_type, scale
+
+
+def retry_delay(response, attempt, backoff, max_backoff):
+    """Seconds to wait before retry number `attempt` (0-based): Retry-After if sent, else jittered exponential backoff."""
+    if response is not None:
+        try:
+            return min(float(response.headers["Retry-After"]), max_backoff)
+        except (KeyError, ValueError):
+            pass
+    return min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class _BaseClient:
+    def __init__(self, base_url=OCR_API_URL, api_key=OCR_API_KEY, concurrency=4, retries=3,
+                 backoff=0.5, max_backoff=30.0, max_width=None, jpeg_quality=None,
+                 min_confidence=None, preprocess=None, timeout=120.0):
+        self.base_url = base_url
+        self.headers = {API_KEY_HEADER: api_key, "accept": "application/json"}
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_width = max_width
+        self.jpeg_quality = jpeg_quality
+        self.timeout = timeout
+        self.params = {}
+        if min_confidence is not None:
+            self.params["min_confidence"] = min_confidence
+        if preprocess is not None:
+            self.params["preprocess"] = preprocess
+        # One keep-alive connection per request that may be in flight
+        self.limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    def _load(self, image):
+        """Returns (filename, data, content_type, scale) for a path, bytes or file object."""
+        if isinstance(image, (str, os.PathLike)):
+            with open(image, "rb") as f:
+                data = f.read()
+            filename = os.path.basename(image)
+        elif isinstance(image, (bytes, bytearray)):
+            data, filename = bytes(image), "receipt"
+        else:
+            data, filename = image.read(), os.path.basename(getattr(image, "name", "receipt"))
+        data, content_type, scale = prepare_image(data, self.max_width, self.jpeg_quality)
+        return filename, data, content_type, scale
+
+    @staticmethod
+    def _items(response, scale):
+        """Items from a successful response, with boxes mapped back to the original image."""
+        if response.status_code != 200:
+            try:
+                detail = response.json().get("detail", response.text)
+            except ValueError:
+                detail = response.text
+            raise ApiError(response.status_code, detail)
+        items = response.json()
+        if scale != 1.0:
+            for item in items:
+                if item.get("bbox"):
+                    item["bbox"] = [round(v / scale) for v in item["bbox"]]
+        return items
+
+
+class OcrClient(_BaseClient):
+    """
+    Blocking client. extract() is safe to call from several threads; at most
+    `concurrency` requests are sent at once. Pass `transport` or a ready
+    httpx.Client as `client` (e.g. FastAPI's TestClient) to use another
+    transport.
+    """
+
+    def __init__(self, base_url=OCR_API_URL, client=None, transport=None, **options):
+        super().__init__(base_url, **options)
+        self._own_client = client is None
+        self.client = client or httpx.Client(
+            base_url=base_url, limits=self.limits, timeout=self.timeout, transport=transport
+        )
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._own_client:
+            self.client.close()
+
+    def extract(self, image):
+        """Extracts the items of one receipt (path, bytes or file object). Raises ApiError on failure."""
+        filename, data, content_type, scale = self._load(image)
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                with self._slots:
+                    response = self.client.post(
+                        "/v1/extract_items", headers=self.headers, params=self.params,
+                        files={"image": (filename, data, content_type)},
+                    )
+                if response.status_code not in RETRY_STATUSES:
+                    break
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            if attempt < self.retries:
+                time.sleep(retry_delay(response, attempt, self.backoff, self.max_backoff))
+        return self._items(response, scale)
+
+    def extract_many(self, images):
+        """
+        Extracts many receipts using `concurrency` threads. Yields
+        (image, items, error) in input order; error is None on success.
+        """
+        def run(image):
+            try:
+                return image, self.extract(image), None
+            except (ApiError, httpx.HTTPError, OSError) as e:
+                return image, None, e
+
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            yield from pool.map(run, images)
+
+
+class AsyncOcrClient(_BaseClient):
+    """
+    asyncio client. At most `concurrency` requests are in flight at once,
+    however many extract() calls are awaited together. Pass `transport`
+    (e.g. httpx.ASGITransport(app=main.app)) to call the app in-process.
+    """
+
+    def __init__(self, base_url=OCR_API_URL, client=None, transport=None, **options):
+        super().__init__(base_url, **options)
+        self._own_client = client is None
+        self.client = client or httpx.AsyncClient(
+            base_url=base_url, limits=self.limits, timeout=self.timeout, transport=transport
+        )
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._own_client:
+            await self.client.aclose()
+
+    async def extract(self, image):
+        """Extracts the items of one receipt (path, bytes or file object). Raises ApiError on failure."""
+        # Reading and resizing are blocking; keep them off the event loop
+        filename, data, content_type, scale = await asyncio.to_thread(self._load, image)
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                async with self._slots:
+                    response = await self.client.post(
+                        "/v1/extract_items", headers=self.headers, params=self.params,
+                        files={"image": (filename, data, content_type)},
+                    )
+                if response.status_code not in RETRY_STATUSES:
+                    break
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            if attempt < self.retries:
+                await asyncio.sleep(retry_delay(response, attempt, self.backoff, self.max_backoff))
+        return self._items(response, scale)
+
+    async def extract_many(self, images):
+        """
+        Extracts many receipts concurrently. Yields (image, items, error) as
+        each finishes; error is None on success. Only 2 x concurrency images
+        are loaded at a time, so any number of images can be passed.
+        """
+        async def run(image):
+            try:
+                return image, await self.extract(image), None
+            except (ApiError, httpx.HTTPError, OSError) as e:
+                return image, None, e
+
+        images = iter(images)
+        pending = set()
+        try:
+            while True:
+                for image in images:
+                    pending.add(asyncio.ensure_future(run(image)))
+                    if len(pending) >= 2 * self.concurrency:
+                        break
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+# ==============================================================================
+# Command line: directory of receipts -> JSONL
+# ==============================================================================
+def find_images(directory):
+    """Image files under `directory`, recursively, in sorted order."""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+    return paths
+
+
+async def run_directory(args, out):
+    paths = find_images(args.directory)
+    options = dict(
+        api_key=args.api_key, concurrency=args.concurrency, retries=args.retries,
+        max_width=args.max_width, jpeg_quality=args.jpeg_quality,
+        min_confidence=args.min_confidence, preprocess=args.preprocess,
+    )
+    failed = 0
+    t0 = time.perf_counter()
+    async with AsyncOcrClient(args.url, **options) as client:
+        async for path, items, error in client.extract_many(paths):
+            record = {"file": os.path.relpath(path, args.directory)}
+            if error is None:
+                record["items"] = items
+            else:
+                failed += 1
+                record["error"] = str(error)
+                if isinstance(error, ApiError):
+                    record["status"] = error.status_code
+            out.write(json.dumps(record) + "\n")
+    print(
+        f"{len(paths)} images, {failed} failed, in {time.perf_counter() - t0:.1f}s",
+        file=sys.stderr,
+    )
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the items of every receipt in a directory as JSONL.")
+    parser.add_argument("directory", help="folder searched recursively for .jpg/.jpeg/.png receipts")
+    parser.add_argument("--out", help="output JSONL file (default: stdout)")
+    parser.add_argument("--url", default=OCR_API_URL, help="API base URL (default: OCR_API_URL)")
+    parser.add_argument("--api-key", default=OCR_API_KEY, help="API key (default: OCR_API_KEY)")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--retries", type=int, default=3, help="retries for 429/503 and connection errors")
+    parser.add_argument("--max-width", type=int, help="downscale wider images to this width before upload")
+    parser.add_argument("--jpeg-quality", type=int, help="re-encode images as JPEG at this quality (1-95)")
+    parser.add_argument("--min-confidence", type=int, help="drop items below this confidence (0-100)")
+    parser.add_argument("--preprocess", help="server preprocessing stages, e.g. 'resize,grayscale'")
+    args = parser.parse_args()
+
+    if args.out:
+        with open(args.out, "w") as out:
+            failed = asyncio.run(run_directory(args, out))
+    else:
+        failed = asyncio.run(run_directory(args, sys.stdout))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
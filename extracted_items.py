@@ -2,20 +2,206 @@
 
 import pytesseract
 import re
+import io
+import os
 import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from PIL import Image
 
+from preprocess import preprocess_image, parse_stages, OCR_TARGET_WIDTH
+from layout import (
+    split_page, repeated_lines, OCR_STRIPS, OCR_STRIP_WORKERS, OCR_STRIP_MIN_HEIGHT, OCR_STRIP_MIN_ASPECT,
+)
+from catalog import get_catalog
+
+try:
+    # Optional: talks to libtesseract directly instead of spawning a process per image
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
 
 # --- Configuration ---
 # On Windows, you must tell pytesseract where you installed Tesseract.
-# Update this path to where your tesseract.exe is located.
-# On Mac/Linux, you can usually leave this commented out.
+# Set TESSERACT_CMD to where your tesseract.exe is located.
+# On Mac/Linux, you can usually leave it unset.
 # For example: r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+TESSERACT_CMD = os.environ.get(
+    "TESSERACT_CMD", r'C:\Program Files\Tesseract-OCR\tesseract.exe' if os.name == 'nt' else ''
+)
+if TESSERACT_CMD:
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+# OCR engine settings
+# OCR_ENGINE: "auto" (tesserocr if installed, else pytesseract), "tesserocr" or "pytesseract"
+# OCR_LANG: Tesseract language(s), e.g. "eng" or "eng+fra"
+# OCR_PSM / OCR_OEM: page segmentation and engine modes; empty means Tesseract's default
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "auto").lower()
+OCR_LANG = os.environ.get("OCR_LANG", "eng")
+OCR_PSM = int(os.environ["OCR_PSM"]) if os.environ.get("OCR_PSM") else None
+OCR_OEM = int(os.environ["OCR_OEM"]) if os.environ.get("OCR_OEM") else None
+# Product catalog that item names are matched against (see catalog.py), or
+# None. Loaded at import so preloaded server workers share it.
+CATALOG = get_catalog()
+
+# Part of the result cache key, since these settings change what OCR reads
+# (or, for the catalog, what its names are mapped to). Reading a page in
+# strips (see layout.py) can change line breaks at the cuts, so the strip
+# settings count when splitting is on.
+OCR_CONFIG = f"lang={OCR_LANG};psm={OCR_PSM};oem={OCR_OEM}"
+OCR_CONFIG += f";engine={'pytesseract' if tesserocr is None or OCR_ENGINE == 'pytesseract' else 'tesserocr'}"
+if OCR_STRIPS and OCR_STRIP_WORKERS > 1:
+    OCR_CONFIG += f";strips={OCR_STRIP_WORKERS},{OCR_STRIP_MIN_HEIGHT},{OCR_STRIP_MIN_ASPECT}"
+if CATALOG is not None:
+    OCR_CONFIG += f";catalog={CATALOG.fingerprint}"
+
+logger = logging.getLogger("ocr.engine")
+
+# Bump this whenever a change can alter the parsed output; it is part of the
+# result cache key, so old cached results are ignored after an upgrade.
+PARSER_VERSION = "3"
 
 # The path to the receipt image you want to process.
 IMAGE_PATH = "./Receipts/11.jpeg" # <-- CHANGE THIS to your image file
 
+# --- Parser tables ---
+# Everything the parser matches against is compiled once, at import time.
+
+# Text that does not contain any of these is not treated as a receipt
+RECEIPT_KEYWORDS = ["total", "subtotal", "cash", "change", "kg", "each", "price", "item", "date", "store", "receipt", "quantity"]
+
+# Comprehensive list of keywords to skip (non-grocery items)
+SKIP_KEYWORDS = [
+    # Receipt metadata
+    "special", "subtotal", "loyalty", "total", "cash", "change", "@", "net", "date", "time",
+    "receipt", "thank", "shopping", "store", "address", "phone", "fax", "www", "com", "org",
+    "open", "closed", "hours", "daily", "weekly", "tax", "taxable", "non-taxable",
+    "items", "count", "register", "transaction", "card", "debit", "credit", "pin",
+    "signature", "authorized", "approved", "declined", "balance", "due", "paid",
+    "refund", "return", "exchange", "discount", "sale", "clearance", "coupon",
+    "member", "customer", "account", "number", "id", "employee", "cashier",
+    "manager", "supervisor", "assistant", "help", "service", "support",
+    # Common receipt headers/footers
+    "welcome", "goodbye", "come again", "visit", "location", "branch",
+    "headquarters", "corporate", "office", "main", "north", "south", "east", "west",
+    "street", "avenue", "road", "drive", "lane", "boulevard", "highway",
+    "suite", "apartment", "floor", "building", "center", "mall", "plaza",
+    "parking", "entrance", "exit", "restroom", "elevator", "escalator",
+    # Time and date patterns
+    "am", "pm", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+    "january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december",
+    # Phone and contact patterns
+    "tel", "telephone", "call", "contact", "email", "website", "web", "online",
+    # Common receipt text
+    "original", "copy", "duplicate", "void", "cancelled", "refunded", "returned",
+    "sold", "bought", "purchased", "bought", "sale", "buy", "sell", "price", "cost",
+    "amount", "value", "worth", "expensive", "cheap", "affordable", "budget",
+    "save", "savings", "money", "dollar", "cent", "penny", "nickel", "dime", "quarter"
+]
+
+# Item names containing one of these get a high confidence score
+GROCERY_KEYWORDS = [
+    'apple', 'banana', 'orange', 'grape', 'strawberry', 'blueberry', 'raspberry', 'blackberry',
+    'peach', 'pear', 'plum', 'cherry', 'apricot', 'nectarine', 'mango', 'pineapple', 'kiwi',
+    'tomato', 'potato', 'onion', 'carrot', 'lettuce', 'spinach', 'kale', 'cabbage', 'broccoli',
+    'cauliflower', 'cucumber', 'pepper', 'bell', 'jalapeno', 'garlic', 'ginger', 'mushroom',
+    'avocado', 'lemon', 'lime', 'grapefruit', 'tangerine', 'clementine', 'mandarin',
+    'zucchini', 'squash', 'pumpkin', 'eggplant', 'asparagus', 'celery', 'radish', 'turnip',
+    'beet', 'parsnip', 'rutabaga', 'sweet potato', 'yam', 'corn', 'peas', 'beans', 'lentil',
+    'milk', 'cheese', 'yogurt', 'cream', 'butter', 'egg', 'eggs', 'cream cheese', 'cottage',
+    'sour cream', 'half and half', 'heavy cream', 'whipping cream', 'buttermilk',
+    'chicken', 'beef', 'pork', 'lamb', 'turkey', 'duck', 'fish', 'salmon', 'tuna', 'cod',
+    'shrimp', 'crab', 'lobster', 'bacon', 'sausage', 'ham', 'steak', 'ground', 'burger',
+    'hot dog', 'hotdog', 'deli', 'lunch meat', 'cold cut',
+    'bread', 'wheat', 'white', 'rye', 'sourdough', 'bagel', 'muffin', 'croissant', 'roll',
+    'tortilla', 'pita', 'naan', 'rice', 'pasta', 'noodle', 'spaghetti', 'penne', 'macaroni',
+    'couscous', 'quinoa', 'oatmeal', 'cereal', 'granola', 'flour', 'sugar', 'salt', 'pepper',
+    'soup', 'sauce', 'ketchup', 'mustard', 'mayonnaise', 'relish', 'pickle', 'olive',
+    'tuna', 'salmon', 'bean', 'corn', 'peas', 'tomato paste', 'tomato sauce', 'broth',
+    'stock', 'juice', 'soda', 'pop', 'cola', 'water', 'tea', 'coffee', 'hot chocolate',
+    'chip', 'cracker', 'cookie', 'biscuit', 'cake', 'pie', 'brownie', 'muffin', 'donut',
+    'candy', 'chocolate', 'gum', 'popcorn', 'pretzel', 'nut', 'almond', 'walnut', 'pecan',
+    'cashew', 'peanut', 'sunflower', 'pumpkin seed', 'raisin', 'dried fruit',
+    'frozen', 'ice cream', 'pizza', 'dinner', 'meal', 'vegetable', 'fruit',
+    'organic', 'natural', 'gluten free', 'vegan', 'vegetarian', 'low fat', 'fat free',
+    'sugar free', 'diet', 'light', 'lite', 'fresh', 'local', 'farm', 'artisan'
+]
+
+# Default units by item name; weight keywords are checked first
+WEIGHT_KEYWORDS = ['flour', 'sugar', 'salt', 'pepper', 'spice', 'herb', 'meat', 'chicken', 'beef', 'pork', 'fish', 'vegetable', 'fruit', 'apple', 'banana', 'tomato', 'potato', 'onion', 'carrot', 'lettuce', 'spinach', 'cheese', 'butter', 'oil', 'sauce', 'dressing', 'powder', 'grain', 'rice', 'pasta', 'bean', 'nut', 'seed']
+VOLUME_KEYWORDS = ['milk', 'water', 'juice', 'soda', 'beer', 'wine', 'oil', 'vinegar', 'sauce', 'soup', 'broth', 'liquid', 'drink', 'beverage']
+
+
+def _keyword_regex(keywords):
+    """
+    Compiles keywords into one regex that finds whether any of them occurs in
+    a string, with the same result as `any(k in text for k in keywords)`.
+
+    The alternation is built from a prefix trie, so the regex engine follows
+    one character at a time instead of trying every keyword at every
+    position. Keywords that contain another keyword can never change the
+    answer and are dropped first.
+    """
+    words = sorted(set(keywords))
+    words = [w for w in words if not any(other != w and other in w for other in words)]
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        # A keyword ends here, so the match is already complete
+        if "" in node:
+            return ""
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    return re.compile(build(trie))
+
+
+RECEIPT_RE = _keyword_regex(RECEIPT_KEYWORDS)
+SKIP_RE = _keyword_regex(SKIP_KEYWORDS)
+GROCERY_RE = _keyword_regex(GROCERY_KEYWORDS)
+WEIGHT_RE = _keyword_regex(WEIGHT_KEYWORDS)
+VOLUME_RE = _keyword_regex(VOLUME_KEYWORDS)
+
+# Enhanced unit detection patterns
+# Common weight units: kg, g, grams, lbs, pounds, oz, ounces
+# Common volume units: l, liters, ml, milliliters, fl oz
+# Common count units: each, pcs, pieces, units
+WEIGHT_UNITS = r'kg|kq|g|grams?|lbs?|pounds?|oz|ounces?'
+VOLUME_UNITS = r'l|liters?|ml|milliliters?|fl\s*oz'
+COUNT_UNITS = r'each|pcs?|pieces?|units?'
+ALL_UNITS = f'(?:{WEIGHT_UNITS}|{VOLUME_UNITS}|{COUNT_UNITS})'
+
+# Pattern: "Quantity: 2 x 0.5 kg" under the item name
+QUANTITY_LINE_RE = re.compile(f'Quantity:\\s*(\\d+)\\s*x\\s*[\\d.]+\\s*({ALL_UNITS})?', re.IGNORECASE)
+# Pattern: quantity and unit on the line after "name price"
+QTY_LINE_RE = re.compile(f'([\\d.]+)\\s*({ALL_UNITS})', re.IGNORECASE)
+
+# One anchored pattern per line format, tried in this order. Each line is
+# classified by a single match of their alternation; the named group that
+# matched tells which format it was.
+LINE_RE = re.compile('|'.join([
+    # 0. Embedded quantity and unit before the name (e.g. "2kg flour", "2l milk")
+    f'(?P<embedded>(?P<e_qty>[\\d.]+)(?P<e_unit>{ALL_UNITS})\\s+(?P<e_name>.+)$)',
+    # 1. Item name + price, quantity/unit possibly on the next line (e.g. "Bananas 1.99")
+    r'(?P<name_price>(?P<np_name>.+?)\s+\$?[\d.]+$)',
+    # 2. Item name, quantity, price (e.g. "Milk 1 1.89")
+    r'(?P<name_qty_price>(?P<nqp_name>.*?)\s+(?P<nqp_qty>\d+)\s+[\d.]+$)',
+    # 3. Item name, quantity, unit (e.g. "ZUCHINNI GREEN 0.778 kg")
+    f'(?P<name_qty_unit>(?P<nqu_name>.*?)\\s+(?P<nqu_qty>[\\d.]+)\\s*(?P<nqu_unit>{ALL_UNITS})$)',
+    # 4. Item name and quantity (e.g. "Eggs 1")
+    r'(?P<name_qty>(?P<nq_name>.*?)\s+(?P<nq_qty>\d+)$)',
+]), re.IGNORECASE)
+
+
 def normalize_unit(unit):
     """
     Normalize unit variations to standard forms.
@@ -52,234 +238,542 @@ def get_default_unit(item_name):
     Intelligently determine the default unit based on the item name.
     """
     item_lower = item_name.lower()
-    
     # Weight-based items
-    weight_keywords = ['flour', 'sugar', 'salt', 'pepper', 'spice', 'herb', 'meat', 'chicken', 'beef', 'pork', 'fish', 'vegetable', 'fruit', 'apple', 'banana', 'tomato', 'potato', 'onion', 'carrot', 'lettuce', 'spinach', 'cheese', 'butter', 'oil', 'sauce', 'dressing', 'powder', 'grain', 'rice', 'pasta', 'bean', 'nut', 'seed']
-    for keyword in weight_keywords:
-        if keyword in item_lower:
-            return 'kg'
-    
+    if WEIGHT_RE.search(item_lower):
+        return 'kg'
     # Volume-based items
-    volume_keywords = ['milk', 'water', 'juice', 'soda', 'beer', 'wine', 'oil', 'vinegar', 'sauce', 'soup', 'broth', 'liquid', 'drink', 'beverage']
-    for keyword in volume_keywords:
-        if keyword in item_lower:
-            return 'l'
-    
+    if VOLUME_RE.search(item_lower):
+        return 'l'
     # Count-based items (default)
     return 'each'
 
-def extract_grocery_items(image_path):
+def load_image(image):
     """
-    Extracts text from a receipt image using Tesseract and parses grocery items.
+    Returns a PIL image for any supported input: a file path, raw image bytes,
+    a binary file-like object, or an already-decoded PIL image.
     """
-    try:
-        # 1. Use Tesseract to extract all text from the image
-        img = Image.open(image_path)
-        full_text = pytesseract.image_to_string(img)
-        lines = full_text.split('\n')
-
-        # Receipt validation logic: check for common receipt keywords
-        receipt_keywords = ["total", "subtotal", "cash", "change", "kg", "each", "price", "item", "date", "store", "receipt", "quantity"]
-        text = ' '.join(lines).lower()
-        if not any(k in text for k in receipt_keywords):
-            return "This does not appear to be a receipt. Please upload a proper receipt image."
-
-        extracted_items = []
-        # Comprehensive list of keywords to skip (non-grocery items)
-        skip_keywords = [
-            # Receipt metadata
-            "special", "subtotal", "loyalty", "total", "cash", "change", "@", "net", "date", "time",
-            "receipt", "thank", "shopping", "store", "address", "phone", "fax", "www", "com", "org",
-            "open", "closed", "hours", "daily", "weekly", "tax", "taxable", "non-taxable",
-            "items", "count", "register", "transaction", "card", "debit", "credit", "pin",
-            "signature", "authorized", "approved", "declined", "balance", "due", "paid",
-            "refund", "return", "exchange", "discount", "sale", "clearance", "coupon",
-            "member", "customer", "account", "number", "id", "employee", "cashier",
-            "manager", "supervisor", "assistant", "help", "service", "support",
-            # Common receipt headers/footers
-            "welcome", "goodbye", "come again", "visit", "location", "branch",
-            "headquarters", "corporate", "office", "main", "north", "south", "east", "west",
-            "street", "avenue", "road", "drive", "lane", "boulevard", "highway",
-            "suite", "apartment", "floor", "building", "center", "mall", "plaza",
-            "parking", "entrance", "exit", "restroom", "elevator", "escalator",
-            # Time and date patterns
-            "am", "pm", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
-            "january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december",
-            # Phone and contact patterns
-            "tel", "telephone", "call", "contact", "email", "website", "web", "online",
-            # Common receipt text
-            "original", "copy", "duplicate", "void", "cancelled", "refunded", "returned",
-            "sold", "bought", "purchased", "bought", "sale", "buy", "sell", "price", "cost",
-            "amount", "value", "worth", "expensive", "cheap", "affordable", "budget",
-            "save", "savings", "money", "dollar", "cent", "penny", "nickel", "dime", "quarter"
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(image))
+    # Paths and file-like objects are both understood by Image.open
+    return Image.open(image)
+
+def reduce_on_decode(img, max_width=None, mode=None):
+    """
+    Lets the decoder of a not yet loaded JPEG skip work: it decodes at the
+    smallest scale (1/2, 1/4 or 1/8) still at least max_width wide, and
+    straight to grayscale when mode is "L". Other images are left alone.
+    """
+    if img.format == "JPEG" and (max_width or mode):
+        width, height = img.size
+        size = None
+        if max_width and width > max_width:
+            size = (max_width, max(1, height * max_width // width))
+        img.draft(mode or img.mode, size)
+
+class OcrWords:
+    """
+    The words Tesseract read on a page, stored column-wise: `text` is a list
+    of strings and the rest are numpy arrays (confidence 0-100, box as
+    left/top/width/height rows, and the text line each word belongs to), so
+    a page costs a handful of arrays instead of a dict per word.
+
+    Line numbers count the lines of the page text as image_to_string would
+    return it, including the blank line between paragraphs.
+    """
+
+    __slots__ = ("text", "conf", "boxes", "line")
+
+    def __init__(self, text, conf, boxes, line):
+        self.text = text
+        self.conf = np.asarray(conf, dtype=np.float32)
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.line = np.asarray(line, dtype=np.int32)
+
+    @classmethod
+    def from_tsv(cls, tsv):
+        """Builds the word table from Tesseract's TSV output (image_to_data)."""
+        text, conf, boxes, line = [], [], [], []
+        line_no = -1
+        last_line = last_par = None
+        for row in tsv.split("\n"):
+            # level, page, block, par, line, word, left, top, width, height, conf, text
+            fields = row.split("\t", 11)
+            if len(fields) < 12 or fields[0] != "5" or not fields[11].strip():
+                continue
+            par = (fields[2], fields[3])
+            if (par, fields[4]) != last_line:
+                # A new paragraph is preceded by a blank line
+                line_no += 2 if last_par is not None and par != last_par else 1
+                last_line, last_par = (par, fields[4]), par
+            text.append(fields[11])
+            conf.append(max(0.0, float(fields[10])))
+            boxes.append((int(fields[6]), int(fields[7]), int(fields[8]), int(fields[9])))
+            line.append(line_no)
+        return cls(text, conf, boxes, line)
+
+    @classmethod
+    def join(cls, parts, offsets, overlaps=()):
+        """
+        Combines the words of page strips read separately, top to bottom.
+        `offsets` gives each strip's (x, y) position on the page. Where
+        `overlaps` says two neighbouring strips overlap, lines read by both
+        are kept once; lines repeated across a clean cut are real lines.
+        """
+        text, conf, boxes, line = [], [], [], []
+        previous_lines = []
+        next_line = 0
+        for i, (part, (dx, dy)) in enumerate(zip(parts, offsets)):
+            part_lines, _ = part.lines()
+            skip = repeated_lines(previous_lines, part_lines) if i and overlaps[i - 1] else 0
+            keep = part.line >= skip
+            text += [t for t, k in zip(part.text, keep) if k]
+            conf.append(part.conf[keep])
+            boxes.append(part.boxes[keep] + (dx, dy, 0, 0))
+            line.append(part.line[keep] - skip + next_line)
+            next_line += len(part_lines) - skip
+            previous_lines = part_lines
+        return cls(text, np.concatenate(conf), np.concatenate(boxes), np.concatenate(line))
+
+    def lines(self):
+        """
+        Returns (lines, line_info): the page text as a list of lines, and for
+        each line (confidence sum, word count, (left, top, right, bottom)),
+        or None for blank lines.
+        """
+        if not self.text:
+            return [], []
+        n = int(self.line[-1]) + 1
+        words = [[] for _ in range(n)]
+        for word, line_no in zip(self.text, self.line.tolist()):
+            words[line_no].append(word)
+
+        counts = np.bincount(self.line, minlength=n)
+        conf_sums = np.bincount(self.line, weights=self.conf, minlength=n)
+        left = np.full(n, np.iinfo(np.int32).max)
+        top = np.full(n, np.iinfo(np.int32).max)
+        right = np.zeros(n, dtype=np.int64)
+        bottom = np.zeros(n, dtype=np.int64)
+        np.minimum.at(left, self.line, self.boxes[:, 0])
+        np.minimum.at(top, self.line, self.boxes[:, 1])
+        np.maximum.at(right, self.line, self.boxes[:, 0] + self.boxes[:, 2])
+        np.maximum.at(bottom, self.line, self.boxes[:, 1] + self.boxes[:, 3])
+
+        line_info = [
+            (float(conf_sums[i]), int(counts[i]), (int(left[i]), int(top[i]), int(right[i]), int(bottom[i])))
+            if counts[i] else None
+            for i in range(n)
         ]
-        
-        # Enhanced unit detection patterns
-        # Common weight units: kg, g, grams, lbs, pounds, oz, ounces
-        # Common volume units: l, liters, ml, milliliters, fl oz
-        # Common count units: each, pcs, pieces, units
-        weight_units = r'(kg|kq|g|grams?|lbs?|pounds?|oz|ounces?)'
-        volume_units = r'(l|liters?|ml|milliliters?|fl\s*oz)'
-        count_units = r'(each|pcs?|pieces?|units?)'
-        all_units = f'({weight_units}|{volume_units}|{count_units})'
-        
-        name_price_pattern = re.compile(r'^(.+?)\s+\$?([\d.]+)$')
-        qty_line_pattern = re.compile(f'([\d.]+)\\s*{all_units}', re.IGNORECASE)
-        # Pattern: item name, quantity, price (e.g., Milk 1 1.89)
-        name_qty_price_pattern = re.compile(r'^(.*?)\s+(\d+)\s+([\d.]+)$')
-        # Pattern: item name, quantity, unit (e.g., ZUCHINNI GREEN 0.778 kg)
-        name_qty_unit_pattern = re.compile(f'^(.*?)\\s+([\d.]+)\\s*{all_units}$', re.IGNORECASE)
-        # Pattern: item name, quantity (e.g., Eggs 1)
-        name_qty_pattern = re.compile(r'^(.*?)\s+(\d+)$')
-        quantity_line_pattern = re.compile(f'Quantity:\\s*(\\d+)\\s*x\\s*([\d.]+)\\s*{all_units}?', re.IGNORECASE)
-        
-        # Pattern: item name with embedded quantity and unit (e.g., "2kg flour", "500g sugar")
-        embedded_qty_unit_pattern = re.compile(f'^([\d.]+){all_units}\\s+(.+)$', re.IGNORECASE)
-
-        # To accumulate items by name for summing quantities
-        item_accumulator = {}
-
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            # Handle two-line item format: previous line is item name, current line is quantity/price/unit
-            if line.lower().startswith('quantity:'):
-                qty_match = quantity_line_pattern.match(line)
-                if qty_match and i > 0:
-                    item_name = lines[i-1].strip()
+        return [" ".join(w) for w in words], line_info
+
+
+class PytesseractEngine:
+    """Runs the tesseract command line program once per image, via pytesseract."""
+
+    name = "pytesseract"
+
+    def __init__(self, lang=OCR_LANG, psm=OCR_PSM, oem=OCR_OEM):
+        self.lang = lang
+        options = []
+        if psm is not None:
+            options.append(f"--psm {psm}")
+        if oem is not None:
+            options.append(f"--oem {oem}")
+        self.config = " ".join(options)
+
+    def image_to_string(self, img):
+        return pytesseract.image_to_string(img, lang=self.lang, config=self.config)
+
+    def image_to_data(self, img):
+        """Words with confidences and boxes, as OcrWords, from a single tesseract run."""
+        return OcrWords.from_tsv(pytesseract.image_to_data(img, lang=self.lang, config=self.config))
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    """
+    Keeps a long-lived libtesseract instance per thread (through tesserocr),
+    so the language model is loaded once instead of once per image.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, lang=OCR_LANG, psm=OCR_PSM, oem=OCR_OEM):
+        self.lang = lang
+        self.psm = psm
+        self.oem = oem
+        self._local = threading.local()
+        self._apis = []
+        self._lock = threading.Lock()
+        # Fail now, rather than on the first request, if tessdata is missing
+        self._api()
+
+    def _api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            kwargs = {"lang": self.lang}
+            if self.psm is not None:
+                kwargs["psm"] = self.psm
+            if self.oem is not None:
+                kwargs["oem"] = self.oem
+            api = tesserocr.PyTessBaseAPI(**kwargs)
+            self._local.api = api
+            with self._lock:
+                self._apis.append(api)
+        return api
+
+    def image_to_string(self, img):
+        api = self._api()
+        try:
+            api.SetImage(img)
+            return api.GetUTF8Text()
+        finally:
+            # Free the page's recognition results so memory stays flat
+            api.Clear()
+
+    def image_to_data(self, img):
+        """Words with confidences and boxes, as OcrWords, from a single recognition pass."""
+        api = self._api()
+        try:
+            api.SetImage(img)
+            return OcrWords.from_tsv(api.GetTSVText(0))
+        finally:
+            api.Clear()
+
+    def close(self):
+        with self._lock:
+            for api in self._apis:
+                api.End()
+            self._apis.clear()
+        self._local = threading.local()
+
+
+def create_ocr_engine(name=OCR_ENGINE, lang=OCR_LANG, psm=OCR_PSM, oem=OCR_OEM):
+    """
+    Builds the configured OCR engine. tesserocr is preferred when available;
+    if it is missing or cannot start, pytesseract is used instead.
+    """
+    if name not in ("auto", "tesserocr", "pytesseract"):
+        raise ValueError(f"OCR_ENGINE must be 'auto', 'tesserocr' or 'pytesseract', not '{name}'")
+    if name != "pytesseract":
+        if tesserocr is None:
+            if name == "tesserocr":
+                logger.warning("tesserocr is not installed; falling back to pytesseract")
+        else:
+            try:
+                return TesserocrEngine(lang, psm, oem)
+            except RuntimeError as e:
+                logger.warning("Could not start tesserocr (%s); falling back to pytesseract", e)
+    return PytesseractEngine(lang, psm, oem)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_ocr_engine():
+    """Returns this process's shared OCR engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_ocr_engine()
+    return _engine
+
+
+_strip_pool = None
+_strip_pool_lock = threading.Lock()
+
+
+def _get_strip_pool():
+    global _strip_pool
+    if _strip_pool is None:
+        with _strip_pool_lock:
+            if _strip_pool is None:
+                _strip_pool = ThreadPoolExecutor(OCR_STRIP_WORKERS, thread_name_prefix="ocr-strip")
+    return _strip_pool
+
+
+def ocr_page(img, timings=None, info=None):
+    """
+    Reads a preprocessed PIL image and returns its words as OcrWords. Tall
+    receipts are cut into horizontal strips between text lines (see
+    layout.split_page), which are read in parallel and joined in order.
+
+    If given, `timings` gets "layout_ms" and "ocr_ms", and `info` gets the
+    number of "strips".
+    """
+    engine = get_ocr_engine()
+    strips, offsets, overlaps = [img], [(0, 0)], []
+    if OCR_STRIPS and OCR_STRIP_WORKERS > 1:
+        t0 = time.perf_counter()
+        strips, offsets, overlaps = split_page(np.asarray(img.convert("L")))
+        if timings is not None:
+            timings["layout_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    t0 = time.perf_counter()
+    if len(strips) == 1:
+        words = engine.image_to_data(img)
+    else:
+        parts = _get_strip_pool().map(lambda strip: engine.image_to_data(Image.fromarray(strip)), strips)
+        words = OcrWords.join(list(parts), offsets, overlaps)
+    if timings is not None:
+        timings["ocr_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    if info is not None:
+        info["strips"] = len(strips)
+    return words
+
+
+def warm_up():
+    """
+    Runs the default preprocessing and one OCR call on a small blank image,
+    so the engine, its language data and the image libraries are loaded
+    before the first real request. Returns the time taken in seconds.
+    """
+    t0 = time.perf_counter()
+    img = preprocess_image(Image.new("RGB", (200, 60), "white"))
+    engine = get_ocr_engine()
+    engine.image_to_string(img)
+    return time.perf_counter() - t0
+
+def _parse_lines(lines, line_info=None):
+    """
+    Parses OCR text lines into grocery items. Returns a list of item dicts,
+    or an error message if the text does not look like a receipt.
+
+    `line_info` (from OcrWords.lines) gives Tesseract's word confidences and
+    boxes per line. With it, each item's confidence is the mean confidence of
+    the words on its lines and the item gets a "bbox" around the lines of its
+    first occurrence (an item seen several times on a receipt is not one
+    box); without it (plain text), confidence is estimated from the item's
+    name and unit.
+
+    With a product catalog (OCR_CATALOG_PATH), item names are replaced by the
+    closest catalog product, so misread spellings of one product add up to a
+    single item, and the product's unit is used when the line gives none.
+    """
+    # Receipt validation logic: check for common receipt keywords
+    if not RECEIPT_RE.search(' '.join(lines).lower()):
+        return "This does not appear to be a receipt. Please upload a proper receipt image."
+
+    # To accumulate items by name for summing quantities
+    item_accumulator = {}
+    # Which lines each item was read from, when there is OCR data to look up
+    item_lines = {} if line_info is not None else None
+    # The lines of each item's first occurrence, for its box
+    first_lines = {}
+
+    # Output name per accumulator key
+    item_names = {}
+
+    def add(item_name, unit, quantity, *line_nos):
+        # unit None means "the item's default unit"
+        product = CATALOG.match(item_name) if CATALOG is not None else None
+        if product is not None:
+            item_name = product.name
+            if unit is None:
+                unit = normalize_unit(product.unit) if product.unit else get_default_unit(item_name)
+            display_name = item_name
+        else:
+            if unit is None:
+                unit = get_default_unit(item_name)
+            display_name = item_name.lower().title()
+        key = (item_name.lower(), unit)
+        item_accumulator[key] = item_accumulator.get(key, 0) + quantity
+        item_names.setdefault(key, display_name)
+        if item_lines is not None:
+            item_lines.setdefault(key, []).extend(line_nos)
+            first_lines.setdefault(key, line_nos)
+
+    i = 0
+    n = len(lines)
+    while i < n:
+        line = lines[i].strip()
+        line_lower = line.lower()
+        i += 1
+        # Handle two-line item format: previous line is item name, current line is quantity/price/unit
+        if line_lower.startswith('quantity:'):
+            qty_match = QUANTITY_LINE_RE.match(line)
+            if qty_match and i > 1:
+                unit = normalize_unit(qty_match.group(2)) if qty_match.group(2) else 'each'
+                add(lines[i-2].strip(), unit, float(qty_match.group(1)), i - 2, i - 1)
+            continue
+        if not line or SKIP_RE.search(line_lower):
+            continue
+
+        m = LINE_RE.match(line)
+        kind = m.lastgroup if m else None
+        if kind == 'embedded':
+            quantity = float(m.group('e_qty'))
+            unit = normalize_unit(m.group('e_unit'))
+            add(m.group('e_name').strip(), unit, quantity, i - 1)
+        elif kind == 'name_price':
+            # Quantity and unit may follow on the next line
+            item_name = m.group('np_name').strip()
+            quantity = 1
+            unit = None  # The item's default unit
+            line_nos = (i - 1,)
+            if i < n:
+                qty_match = QTY_LINE_RE.search(lines[i].strip())
+                if qty_match:
                     quantity = float(qty_match.group(1))
-                    unit = normalize_unit(qty_match.group(3)) if qty_match.group(3) else 'each'
-                    key = (item_name.lower(), unit)
-                    item_accumulator[key] = item_accumulator.get(key, 0) + quantity
-                i += 1
-                continue
-            if not line or any(k in line.lower() for k in skip_keywords):
-                i += 1
-                continue
-                
-            # 0. Check for embedded quantity and unit in item name (e.g., "2kg flour", "500g sugar")
-            embedded_match = embedded_qty_unit_pattern.match(line)
-            if embedded_match:
-                quantity = float(embedded_match.group(1))
-                unit = normalize_unit(embedded_match.group(2))
-                item_name = embedded_match.group(3).strip()
-                key = (item_name.lower(), unit)
-                item_accumulator[key] = item_accumulator.get(key, 0) + quantity
-                i += 1
-                continue
-            # 1. Item name + price, then quantity/unit on next line
-            name_price_match = name_price_pattern.match(line)
-            if name_price_match:
-                item_name = name_price_match.group(1).strip()
-                quantity = 1
-                unit = get_default_unit(item_name)  # Use intelligent default
-                if i + 1 < len(lines):
-                    next_line = lines[i+1].strip()
-                    qty_match = qty_line_pattern.search(next_line)
-                    if qty_match:
-                        quantity = float(qty_match.group(1))
-                        unit = normalize_unit(qty_match.group(2))
-                        i += 2
-                    else:
-                        i += 1
-                else:
+                    unit = normalize_unit(qty_match.group(2))
+                    line_nos = (i - 1, i)
                     i += 1
-                key = (item_name.lower(), unit)
-                item_accumulator[key] = item_accumulator.get(key, 0) + quantity
-                continue
-            # 2. Item name, quantity, price (all on one line)
-            name_qty_price_match = name_qty_price_pattern.match(line)
-            if name_qty_price_match:
-                item_name = name_qty_price_match.group(1).strip()
-                quantity = float(name_qty_price_match.group(2))
-                unit = get_default_unit(item_name)  # Use intelligent default
-                key = (item_name.lower(), unit)
-                item_accumulator[key] = item_accumulator.get(key, 0) + quantity
-                i += 1
-                continue
-            # 3. Item name, quantity, unit (all on one line)
-            name_qty_unit_match = name_qty_unit_pattern.match(line)
-            if name_qty_unit_match:
-                item_name = name_qty_unit_match.group(1).strip()
-                quantity = float(name_qty_unit_match.group(2))
-                unit = normalize_unit(name_qty_unit_match.group(3))
-                key = (item_name.lower(), unit)
-                item_accumulator[key] = item_accumulator.get(key, 0) + quantity
-                i += 1
-                continue
-            # 4. Item name and quantity (all on one line)
-            name_qty_match = name_qty_pattern.match(line)
-            if name_qty_match:
-                item_name = name_qty_match.group(1).strip()
-                quantity = float(name_qty_match.group(2))
-                unit = get_default_unit(item_name)  # Use intelligent default
-                key = (item_name.lower(), unit)
-                item_accumulator[key] = item_accumulator.get(key, 0) + quantity
-                i += 1
-                continue
-            # 5. Item name only (likely with price, no quantity/unit)
-            # Try to match lines that look like an item name (not a keyword, not empty, not a header)
-            if len(line.split()) > 1 and not any(k in line.lower() for k in skip_keywords):
-                item_name = line.strip()
-                quantity = 1
-                unit = get_default_unit(item_name)  # Use intelligent default
-                key = (item_name.lower(), unit)
-                item_accumulator[key] = item_accumulator.get(key, 0) + quantity
-            i += 1
-
-        # Convert accumulator to output format
-        extracted_items = []
-        for k, v in item_accumulator.items():
-            item_name = k[0].title()
-            unit = k[1]
+            add(item_name, unit, quantity, *line_nos)
+        elif kind == 'name_qty_price':
+            item_name = m.group('nqp_name').strip()
+            add(item_name, None, float(m.group('nqp_qty')), i - 1)
+        elif kind == 'name_qty_unit':
+            add(m.group('nqu_name').strip(), normalize_unit(m.group('nqu_unit')), float(m.group('nqu_qty')), i - 1)
+        elif kind == 'name_qty':
+            item_name = m.group('nq_name').strip()
+            add(item_name, None, float(m.group('nq_qty')), i - 1)
+        # 5. Item name only (likely with price, no quantity/unit)
+        elif len(line.split()) > 1:
+            add(line, None, 1, i - 1)
+
+    # Convert accumulator to output format
+    extracted_items = []
+    for (name, unit), quantity in item_accumulator.items():
+        item_name = item_names[(name, unit)]
+        bbox = None
+        if item_lines is not None:
+            confidence, bbox = _ocr_confidence(item_lines[(name, unit)], line_info, first_lines[(name, unit)])
+        else:
             # Confidence scoring
             confidence = 0.6  # default
             # High confidence if item name contains a grocery keyword
-            grocery_keywords = [
-                'apple', 'banana', 'orange', 'grape', 'strawberry', 'blueberry', 'raspberry', 'blackberry',
-                'peach', 'pear', 'plum', 'cherry', 'apricot', 'nectarine', 'mango', 'pineapple', 'kiwi',
-                'tomato', 'potato', 'onion', 'carrot', 'lettuce', 'spinach', 'kale', 'cabbage', 'broccoli',
-                'cauliflower', 'cucumber', 'pepper', 'bell', 'jalapeno', 'garlic', 'ginger', 'mushroom',
-                'avocado', 'lemon', 'lime', 'grapefruit', 'tangerine', 'clementine', 'mandarin',
-                'zucchini', 'squash', 'pumpkin', 'eggplant', 'asparagus', 'celery', 'radish', 'turnip',
-                'beet', 'parsnip', 'rutabaga', 'sweet potato', 'yam', 'corn', 'peas', 'beans', 'lentil',
-                'milk', 'cheese', 'yogurt', 'cream', 'butter', 'egg', 'eggs', 'cream cheese', 'cottage',
-                'sour cream', 'half and half', 'heavy cream', 'whipping cream', 'buttermilk',
-                'chicken', 'beef', 'pork', 'lamb', 'turkey', 'duck', 'fish', 'salmon', 'tuna', 'cod',
-                'shrimp', 'crab', 'lobster', 'bacon', 'sausage', 'ham', 'steak', 'ground', 'burger',
-                'hot dog', 'hotdog', 'deli', 'lunch meat', 'cold cut',
-                'bread', 'wheat', 'white', 'rye', 'sourdough', 'bagel', 'muffin', 'croissant', 'roll',
-                'tortilla', 'pita', 'naan', 'rice', 'pasta', 'noodle', 'spaghetti', 'penne', 'macaroni',
-                'couscous', 'quinoa', 'oatmeal', 'cereal', 'granola', 'flour', 'sugar', 'salt', 'pepper',
-                'soup', 'sauce', 'ketchup', 'mustard', 'mayonnaise', 'relish', 'pickle', 'olive',
-                'tuna', 'salmon', 'bean', 'corn', 'peas', 'tomato paste', 'tomato sauce', 'broth',
-                'stock', 'juice', 'soda', 'pop', 'cola', 'water', 'tea', 'coffee', 'hot chocolate',
-                'chip', 'cracker', 'cookie', 'biscuit', 'cake', 'pie', 'brownie', 'muffin', 'donut',
-                'candy', 'chocolate', 'gum', 'popcorn', 'pretzel', 'nut', 'almond', 'walnut', 'pecan',
-                'cashew', 'peanut', 'sunflower', 'pumpkin seed', 'raisin', 'dried fruit',
-                'frozen', 'ice cream', 'pizza', 'dinner', 'meal', 'vegetable', 'fruit',
-                'organic', 'natural', 'gluten free', 'vegan', 'vegetarian', 'low fat', 'fat free',
-                'sugar free', 'diet', 'light', 'lite', 'fresh', 'local', 'farm', 'artisan'
-            ]
-            if any(keyword in item_name.lower() for keyword in grocery_keywords):
+            if GROCERY_RE.search(item_name.lower()):
                 confidence = 0.95
             # Higher confidence if unit is not 'each'
             if unit != 'each':
                 confidence = max(confidence, 0.85)
-            extracted_items.append({
-                "item_name": item_name,
-                "quantity": v,
-                "unit": unit,
-                "confidence": confidence
-            })
+        item = {
+            "item_name": item_name,
+            "quantity": quantity,
+            "unit": unit,
+            "confidence": confidence
+        }
+        if bbox is not None:
+            item["bbox"] = bbox
+        extracted_items.append(item)
 
-        return extracted_items
+    return extracted_items
 
-    except FileNotFoundError:
-        return f"Error: The file '{image_path}' was not found."
+def _ocr_confidence(line_nos, line_info, box_line_nos=None):
+    """
+    Mean word confidence (0-1) over the given lines, and the box around
+    `box_line_nos` (all of them by default) as [left, top, width, height].
+    """
+    conf_sum = words = 0
+    left = top = right = bottom = None
+    box_line_nos = set(line_nos if box_line_nos is None else box_line_nos)
+    for line_no in set(line_nos):
+        info = line_info[line_no] if line_no < len(line_info) else None
+        if info is None:
+            continue
+        conf_sum += info[0]
+        words += info[1]
+        if line_no not in box_line_nos:
+            continue
+        l, t, r, b = info[2]
+        if left is None:
+            left, top, right, bottom = l, t, r, b
+        else:
+            left, top, right, bottom = min(left, l), min(top, t), max(right, r), max(bottom, b)
+    if not words:
+        return 0.0, None
+    bbox = [left, top, right - left, bottom - top] if left is not None else None
+    return round(conf_sum / words / 100, 2), bbox
+
+def parse_receipt_text(text):
+    """
+    Parses receipt text into grocery items without running OCR, for callers
+    that already have the text (scanner firmware, e-receipts, stored OCR).
+
+    `text` is either the full text or a list of its lines. Returns the same
+    list of item dicts as extract_grocery_items, or an error message.
+    """
+    try:
+        lines = text.split('\n') if isinstance(text, str) else list(text)
+        return _parse_lines(lines)
     except Exception as e:
         return f"An error occurred: {e}"
 
+def extract_grocery_items_timed(image, preprocess=None):
+    """
+    Same as extract_grocery_items, but returns (result, timings, info) where
+    timings maps each stage (decode, preprocessing steps, layout, ocr, parse)
+    to its duration as "<stage>_ms", and info holds what is known about the
+    input: "width" and "height" of the image, OCR "strips", text "lines" and
+    "items" found. Items read by OCR carry Tesseract's confidence and a
+    "bbox" (see _parse_lines).
+    """
+    timings = {}
+    info = {}
+    try:
+        # 1. Decode and preprocess the image. Large JPEGs are decoded at a
+        # reduced scale when the resize stage would shrink them anyway.
+        stages = parse_stages(preprocess)
+        t0 = time.perf_counter()
+        img = load_image(image)
+        info["width"], info["height"] = img.size
+        reduce_on_decode(
+            img,
+            max_width=OCR_TARGET_WIDTH if "resize" in stages else None,
+            mode="L" if "grayscale" in stages else None,
+        )
+        img.load()
+        timings["decode_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        # Item boxes are reported in pixels of the image as uploaded
+        ocr_width = min(img.width, OCR_TARGET_WIDTH) if "resize" in stages else img.width
+        scale = info["width"] / ocr_width
+        origin = {}
+        img = preprocess_image(img, stages, timings, origin)
+
+        # 2. Use Tesseract to read the words, with their confidences and boxes
+        words = ocr_page(img, timings, info)
+
+        # 3. Parse the text into items
+        t0 = time.perf_counter()
+        lines, line_info = words.lines()
+        result = _parse_lines(lines, line_info)
+        timings["parse_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        info["lines"] = len(lines)
+        if isinstance(result, list):
+            info["items"] = len(result)
+            dx, dy = origin.get("offset", (0, 0))
+            for item in result:
+                if "bbox" not in item:
+                    continue
+                if origin.get("rotated"):
+                    # Boxes on the straightened image are not boxes on the upload
+                    del item["bbox"]
+                elif scale != 1 or dx or dy:
+                    x, y, w, h = item["bbox"]
+                    item["bbox"] = [round(v * scale) for v in (x + dx, y + dy, w, h)]
+        return result, timings, info
+
+    except FileNotFoundError:
+        return f"Error: The file '{image}' was not found.", timings, info
+    except Exception as e:
+        return f"An error occurred: {e}", timings, info
+
+def extract_grocery_items(image, preprocess=None):
+    """
+    Extracts text from a receipt image using Tesseract and parses grocery items.
+
+    `image` can be a file path, raw image bytes, a binary file-like object,
+    or a PIL image, so callers never need to write uploads to disk.
+    `preprocess` selects the image preprocessing stages (see
+    preprocess.parse_stages); None uses the configured default.
+    """
+    return extract_grocery_items_timed(image, preprocess)[0]
+
 if __name__ == "__main__":
     items = extract_grocery_items(IMAGE_PATH)
     
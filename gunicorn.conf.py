@@ -0,0 +1,85 @@
+# gunicorn.conf.py
+#
+# Production server: several uvicorn worker processes behind one gunicorn
+# master, so every core is used.
+#
+#   gunicorn -c gunicorn.conf.py main:app
+#
+# The app is imported once in the master before forking (preload_app), so
+# the Python modules, OpenCV/NumPy/Tesseract libraries and the compiled
+# parser tables and product catalog index are loaded once and shared
+# copy-on-write by the workers.
+# Each worker then creates its own OCR pool, cache and job threads and runs a
+# warm-up OCR call before it accepts requests (see main.lifespan).
+
+import gc
+import glob
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+
+# --- Configuration ---
+# PORT: port to listen on.
+# WEB_CONCURRENCY: number of worker processes (default: one per CPU core).
+# OCR_WORKERS: OCR calls run at once per worker process. Defaults to the
+#   cores divided among the worker processes, so the machine is not
+#   oversubscribed.
+# OCR_STRIP_WORKERS: threads reading the strips of one tall receipt in
+#   parallel (see layout.py). Defaults to the cores left over per OCR call,
+#   usually 1 (no strips); lower OCR_WORKERS to trade throughput for
+#   latency on long receipts.
+# OCR_GRACEFUL_TIMEOUT: seconds a stopping worker gets to finish the requests
+#   and OCR calls it is already running.
+# OCR_REQUEST_TIMEOUT: seconds a worker may go silent before it is restarted.
+# OCR_METRICS_DIR: where the workers share their metrics, so /metrics covers
+#   all of them whichever one answers (see metrics.py). Defaults to a new
+#   temporary directory when there is more than one worker.
+PORT = int(os.environ.get("PORT", 7860))
+CPUS = multiprocessing.cpu_count()
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", CPUS))
+os.environ.setdefault("OCR_WORKERS", str(max(1, CPUS // max(1, WEB_CONCURRENCY))))
+os.environ.setdefault(
+    "OCR_STRIP_WORKERS", str(max(1, CPUS // (max(1, WEB_CONCURRENCY) * max(1, int(os.environ["OCR_WORKERS"])))))
+)
+OWN_METRICS_DIR = WEB_CONCURRENCY > 1 and not os.environ.get("OCR_METRICS_DIR")
+if OWN_METRICS_DIR:
+    os.environ["OCR_METRICS_DIR"] = tempfile.mkdtemp(prefix="ocr-metrics-")
+
+bind = f"0.0.0.0:{PORT}"
+workers = WEB_CONCURRENCY
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+graceful_timeout = int(os.environ.get("OCR_GRACEFUL_TIMEOUT", 30))
+timeout = int(os.environ.get("OCR_REQUEST_TIMEOUT", 120))
+keepalive = 5
+accesslog = "-"
+
+
+def when_ready(server):
+    # Runs in the master after the app is preloaded and before any worker is
+    # forked. Moving everything allocated so far out of the garbage
+    # collector's reach stops collections in the workers from touching (and
+    # so copying) the shared pages.
+    gc.freeze()
+
+
+def on_starting(server):
+    # Figures left by the workers of an earlier run would be added to ours
+    metrics_dir = os.environ.get("OCR_METRICS_DIR")
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    # Keeps the exited worker's counts in the totals but drops its gauges
+    import metrics
+
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if OWN_METRICS_DIR:
+        shutil.rmtree(os.environ["OCR_METRICS_DIR"], ignore_errors=True)
@@ -0,0 +1,361 @@
+# jobs.py
+
+import argparse
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from extracted_items import extract_grocery_items
+
+
+# --- Configuration ---
+# OCR_JOBS_DB: sqlite file holding the job queue. Every API process and worker
+#   process pointed at the same file shares the same queue.
+# OCR_JOB_WORKERS: worker threads started inside each API process (0 = none,
+#   leave the work to standalone `python jobs.py` processes). Their OCR runs
+#   in the API's OCR pool, next to the requests.
+# OCR_JOB_LEASE: seconds a worker may hold a job before it is considered dead
+#   and the job is handed to another worker.
+# OCR_JOB_MAX_ATTEMPTS: how often a job is tried before it is marked failed.
+# OCR_JOB_RETENTION: seconds finished jobs are kept before being purged.
+# OCR_WEBHOOK_ALLOWED_HOSTS: comma-separated host names callback URLs may
+#   point at. When empty, any host is allowed as long as all its addresses
+#   are public: loopback, private, link-local (cloud metadata) and other
+#   internal addresses are refused.
+OCR_JOBS_DB = os.environ.get("OCR_JOBS_DB", "jobs.db")
+OCR_JOB_WORKERS = int(os.environ.get("OCR_JOB_WORKERS", 1))
+OCR_JOB_LEASE = float(os.environ.get("OCR_JOB_LEASE", 300))
+OCR_JOB_MAX_ATTEMPTS = int(os.environ.get("OCR_JOB_MAX_ATTEMPTS", 3))
+OCR_JOB_RETENTION = float(os.environ.get("OCR_JOB_RETENTION", 7 * 24 * 3600))
+OCR_WEBHOOK_ALLOWED_HOSTS = frozenset(
+    h.strip().lower() for h in os.environ.get("OCR_WEBHOOK_ALLOWED_HOSTS", "").split(",") if h.strip()
+)
+# Seconds an idle worker sleeps before looking for new jobs again.
+POLL_INTERVAL = 0.5
+WEBHOOK_TIMEOUT = 5
+# Webhooks are sent from their own threads, so a slow receiver does not hold up a job worker
+WEBHOOK_THREADS = 4
+
+logger = logging.getLogger("ocr.jobs")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    image BLOB,
+    callback_url TEXT,
+    owner TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+class JobQueue:
+    """
+    A persistent job queue in a local sqlite file. Safe to use from many
+    threads and processes at once; each thread gets its own connection.
+    """
+
+    def __init__(self, path=OCR_JOBS_DB, lease=OCR_JOB_LEASE, max_attempts=OCR_JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        db = self._connect()
+        db.executescript(SCHEMA)
+        if "owner" not in [row[1] for row in db.execute("PRAGMA table_info(jobs)")]:
+            # Queues created before jobs were tied to the key that made them
+            db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        db.commit()
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def enqueue(self, image_bytes, callback_url=None, owner=None):
+        """Stores the image and returns the new job's id. `owner` names the API key that created it."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO jobs (id, status, image, callback_url, owner, created_at, updated_at)"
+            " VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, image_bytes, callback_url, owner, now, now),
+        )
+        return job_id
+
+    def get(self, job_id, owner=None):
+        """
+        Returns the job as a dict (without the image), or None if unknown.
+        With `owner`, jobs created by another API key count as unknown.
+        """
+        row = self._connect().execute(
+            "SELECT id, status, result, error, attempts, owner, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None or (owner is not None and row["owner"] != owner):
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def claim(self):
+        """
+        Atomically takes the oldest runnable job and returns
+        (job_id, image_bytes, callback_url), or None if there is nothing to do.
+        Jobs whose worker died (expired lease) are runnable again, unless
+        they have used up their attempts, in which case they are failed.
+        """
+        db = self._connect()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, image = NULL, lease_expires = NULL, updated_at = ?"
+                " WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                ("The job's worker stopped responding too many times.", now, now, self.max_attempts),
+            )
+            row = db.execute(
+                "SELECT id, image, callback_url FROM jobs"
+                " WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_expires = ?, updated_at = ? WHERE id = ?",
+                (now + self.lease, now, row["id"]),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return row["id"], row["image"], row["callback_url"]
+
+    def complete(self, job_id, result):
+        self._finish(job_id, "done", result=json.dumps(result))
+
+    def fail(self, job_id, error, retry=False):
+        """Marks a job failed, or puts it back in the queue if it may be retried."""
+        if retry:
+            row = self._connect().execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None and row["attempts"] < self.max_attempts:
+                self._connect().execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, lease_expires = NULL, updated_at = ? WHERE id = ?",
+                    (error, time.time(), job_id),
+                )
+                return
+        self._finish(job_id, "failed", error=error)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        # The image is no longer needed once a job has finished
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, image = NULL, lease_expires = NULL, updated_at = ? WHERE id = ?",
+            (status, result, error, time.time(), job_id),
+        )
+
+    def purge(self, older_than=OCR_JOB_RETENTION):
+        """Deletes finished jobs last updated more than `older_than` seconds ago."""
+        self._connect().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - older_than,),
+        )
+
+    def counts(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class InvalidCallbackUrl(ValueError):
+    """The callback URL is malformed or points somewhere webhooks may not go."""
+
+
+def check_callback_url(url, allowed_hosts=OCR_WEBHOOK_ALLOWED_HOSTS):
+    """
+    Raises InvalidCallbackUrl unless webhooks may be POSTed to `url`: an
+    http(s) URL whose host is in `allowed_hosts`, or, with no allowlist,
+    whose host resolves only to public addresses. Resolving the host blocks.
+    """
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        raise InvalidCallbackUrl("callback_url is not a valid URL")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise InvalidCallbackUrl("callback_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise InvalidCallbackUrl(f"callback_url host '{host}' is not allowed")
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, UnicodeError):
+        raise InvalidCallbackUrl(f"callback_url host '{host}' could not be resolved")
+    for address in addresses:
+        # Drop the scope of link-local IPv6 addresses ("fe80::1%eth0")
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise InvalidCallbackUrl("callback_url must point to a public address")
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    # A redirect could lead anywhere, including the addresses refused above
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_webhook_opener = urllib.request.build_opener(_NoRedirects)
+_webhook_pool = None
+_webhook_pool_lock = threading.Lock()
+
+
+def send_webhook(url, payload):
+    """POSTs the finished job as JSON to the client's callback URL."""
+    try:
+        # Checked again: what the host name resolves to may have changed
+        check_callback_url(url)
+        req = urllib.request.Request(
+            url,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with _webhook_opener.open(req, timeout=WEBHOOK_TIMEOUT) as resp:
+            resp.read()
+    except Exception as e:
+        logger.warning("Webhook %s failed: %s", url, e)
+
+
+def send_webhook_later(url, payload):
+    """Queues send_webhook on the webhook threads and returns at once."""
+    global _webhook_pool
+    if _webhook_pool is None:
+        with _webhook_pool_lock:
+            if _webhook_pool is None:
+                _webhook_pool = ThreadPoolExecutor(WEBHOOK_THREADS, thread_name_prefix="ocr-webhook")
+    _webhook_pool.submit(send_webhook, url, payload)
+
+
+class JobWorker(threading.Thread):
+    """
+    Background thread that runs queued jobs through extract_grocery_items.
+
+    `formatter` converts the extracted items into the stored result (the API
+    passes its GroceryItem formatter so stored results match the response).
+    `extract` replaces the extract_grocery_items call; the API passes one
+    that runs it in its OCR pool, so jobs and requests share the same
+    OCR workers.
+    """
+
+    def __init__(self, queue, formatter=None, name=None, extract=None):
+        super().__init__(name=name or "ocr-job-worker", daemon=True)
+        self.queue = queue
+        self.formatter = formatter or (lambda items: items)
+        self.extract = extract or extract_grocery_items
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        last_purge = 0
+        while not self._stop_event.is_set():
+            try:
+                if not self.run_once():
+                    if time.time() - last_purge > 3600:
+                        self.queue.purge()
+                        last_purge = time.time()
+                    self._stop_event.wait(POLL_INTERVAL)
+            except Exception:
+                logger.exception("Job worker error")
+                self._stop_event.wait(POLL_INTERVAL)
+
+    def run_once(self):
+        """Processes one job. Returns False if the queue was empty."""
+        claimed = self.queue.claim()
+        if claimed is None:
+            return False
+        job_id, image_bytes, callback_url = claimed
+
+        try:
+            extracted_data = self.extract(image_bytes)
+        except Exception as e:
+            # Unexpected failures may be transient, so the job is retried
+            self.queue.fail(job_id, f"An internal error occurred: {e}", retry=True)
+        else:
+            if isinstance(extracted_data, str):
+                self.queue.fail(job_id, extracted_data)
+            else:
+                self.queue.complete(job_id, self.formatter(extracted_data))
+
+        if callback_url:
+            job = self.queue.get(job_id)
+            if job["status"] in ("done", "failed"):
+                send_webhook_later(callback_url, job_to_response(job))
+        return True
+
+
+def job_to_response(job):
+    """Public representation of a job, as returned by GET /v1/jobs/{id}."""
+    response = {
+        "id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+    if job["status"] == "done":
+        response["items"] = job["result"]
+    if job["status"] == "failed":
+        response["error"] = job["error"]
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run OCR job workers against the sqlite job queue.")
+    parser.add_argument("--db", default=OCR_JOBS_DB, help="Path to the job queue database")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker threads in this process")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    # Imported here so the API module is only loaded by standalone workers
+    from main import format_items
+
+    queue = JobQueue(args.db)
+    workers = [JobWorker(queue, formatter=format_items, name=f"ocr-job-worker-{i}") for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    logger.info("Started %d job workers on %s", len(workers), args.db)
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# layout.py
+
+import os
+
+import cv2
+import numpy as np
+
+
+# --- Configuration ---
+# OCR_STRIPS: "0" always OCRs the page in one piece.
+# OCR_STRIP_WORKERS: most strips a page is split into, and threads (each with
+#   its own Tesseract engine) used to OCR them. Defaults to the cores left
+#   over per OCR call, i.e. the core count divided by OCR_WORKERS, which is 1
+#   unless OCR_WORKERS is lowered; gunicorn.conf.py also accounts for the
+#   worker processes.
+# OCR_STRIP_MIN_HEIGHT: strips are never shorter than this (pixels), so short
+#   receipts stay in one piece.
+# OCR_STRIP_MIN_ASPECT: only pages at least this many times taller than wide
+#   are split.
+OCR_STRIPS = os.environ.get("OCR_STRIPS", "1") != "0"
+CPUS = os.cpu_count() or 1
+OCR_STRIP_WORKERS = int(os.environ.get(
+    "OCR_STRIP_WORKERS", max(1, CPUS // max(1, int(os.environ.get("OCR_WORKERS", CPUS))))
+))
+OCR_STRIP_MIN_HEIGHT = int(os.environ.get("OCR_STRIP_MIN_HEIGHT", 400))
+OCR_STRIP_MIN_ASPECT = float(os.environ.get("OCR_STRIP_MIN_ASPECT", 1.5))
+
+# Rows (or columns) with fewer ink pixels than this fraction of the width are blank.
+INK_FRACTION = 0.002
+# Blank rows needed between two text lines for a cut to go there.
+MIN_GAP = 3
+# White border added around every strip; Tesseract reads text touching the
+# image edge poorly.
+PADDING = 10
+# Overlap between strips when no blank gap is found near a cut.
+OVERLAP = 40
+
+
+def ink_mask(gray):
+    """Boolean array, True where a pixel is dark (text)."""
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return ink.astype(bool)
+
+
+def text_band(ink):
+    """
+    Returns (top, bottom, left, right) bounding the text, from the row and
+    column projection profiles of the ink mask, or None if there is no text.
+    """
+    rows = np.flatnonzero(ink.sum(axis=1) > max(1, ink.shape[1] * INK_FRACTION))
+    cols = np.flatnonzero(ink.sum(axis=0) > max(1, ink.shape[0] * INK_FRACTION))
+    if rows.size == 0 or cols.size == 0:
+        return None
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+def blank_gaps(ink):
+    """Centres of the runs of at least MIN_GAP blank rows, as an array of row indices."""
+    blank = ink.sum(axis=1) <= max(1, ink.shape[1] * INK_FRACTION)
+    # Run boundaries: +1 where a blank run starts, -1 just after it ends
+    edges = np.diff(np.concatenate(([0], blank.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = ends - starts >= MIN_GAP
+    return (starts[keep] + ends[keep]) // 2
+
+
+def plan_strips(height, gaps, n_strips, window):
+    """
+    Splits rows [0, height) into up to n_strips (start, end) ranges. Each cut
+    goes to the blank gap nearest its ideal position if one is within
+    `window` rows; otherwise the neighbouring strips overlap by OVERLAP rows
+    around the ideal position.
+    """
+    strips = []
+    start = 0
+    for k in range(1, n_strips):
+        ideal = height * k // n_strips
+        near = gaps[(gaps > start) & (np.abs(gaps - ideal) <= window)] if gaps.size else gaps
+        if near.size:
+            cut = int(near[np.argmin(np.abs(near - ideal))])
+            strips.append((start, cut))
+            start = cut
+        else:
+            strips.append((start, min(height, ideal + OVERLAP // 2)))
+            start = max(0, ideal - OVERLAP // 2)
+    strips.append((start, height))
+    return strips
+
+
+def split_page(gray, max_strips=None, min_height=None, min_aspect=None):
+    """
+    Finds the text on a grayscale page (numpy array) and cuts it into
+    horizontal strips that can be OCR'd independently.
+
+    Returns (strips, offsets, overlaps): the strip images top to bottom,
+    each with a white border; the (x, y) position of each strip image's
+    top-left corner on the page; and for each cut between two strips,
+    whether the strips overlap there (so the text both read must be
+    de-duplicated when joined). Pages that are empty, short or not tall
+    enough come back as one strip.
+    """
+    max_strips = max_strips or OCR_STRIP_WORKERS
+    min_height = min_height or OCR_STRIP_MIN_HEIGHT
+    min_aspect = min_aspect or OCR_STRIP_MIN_ASPECT
+
+    ink = ink_mask(gray)
+    band = text_band(ink)
+    if band is None:
+        return [gray], [(0, 0)], []
+    top, bottom, left, right = band
+    height, width = bottom - top, right - left
+    n_strips = min(max_strips, height // min_height)
+    if n_strips < 2 or height < min_aspect * width:
+        return [gray], [(0, 0)], []
+
+    # Crop to the text band, then cut between text lines
+    band_ink = ink[top:bottom, left:right]
+    band_gray = gray[top:bottom, left:right]
+    plan = plan_strips(height, blank_gaps(band_ink), n_strips, window=height // n_strips // 4)
+    overlaps = [end > next_start for (_, end), (next_start, _) in zip(plan, plan[1:])]
+    strips = [
+        cv2.copyMakeBorder(band_gray[start:end], PADDING, PADDING, PADDING, PADDING, cv2.BORDER_CONSTANT, value=255)
+        for start, end in plan
+    ]
+    offsets = [(int(left) - PADDING, int(top) + start - PADDING) for start, _ in plan]
+    return strips, offsets, overlaps
+
+
+def repeated_lines(previous, following):
+    """
+    Number of lines at the start of `following` that repeat the last lines
+    of `previous` (the text two overlapping strips both read).
+    """
+    for n in range(min(len(previous), len(following)), 0, -1):
+        if [l.strip() for l in previous[-n:]] == [l.strip() for l in following[:n]]:
+            return n
+    return 0
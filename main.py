@@ -1,34 +1,59 @@
 # main.py - FINAL CORRECTED VERSION
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Security, Depends
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Security, Depends, Request, Response, Header, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import APIKeyHeader
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional, Union
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import logging
 import os
-import uuid
 import time
 
 # ==============================================================================
 # 1. IMPORT YOUR EXTRACTION FUNCTION
 # ==============================================================================
-from extracted_items import extract_grocery_items
+from extracted_items import extract_grocery_items, extract_grocery_items_timed, parse_receipt_text, warm_up, PARSER_VERSION, OCR_CONFIG
+from preprocess import parse_stages, OCR_TARGET_WIDTH
+from ocr_pool import OCRPool, PoolFull, ClientDisconnected
+from result_cache import ResultCache, cache_key
+from uploads import (
+    iter_batch_images, read_upload, check_image, BodySizeLimitMiddleware, ImageSignatureMiddleware,
+    TooManyImages, UploadTooLarge, UnsupportedImageType,
+    OCR_MAX_UPLOAD_BYTES, OCR_MAX_REQUEST_BYTES, MULTIPART_OVERHEAD,
+)
+from ocr_pool import OCR_WORKERS
+from jobs import JobQueue, JobWorker, InvalidCallbackUrl, check_callback_url, job_to_response, OCR_JOB_WORKERS
+import metrics
+from metrics import OCR_METRICS, OCR_SERVER_TIMING
+from auth import ApiKeyMiddleware, load_keyring, create_limiter
 
 # ==============================================================================
 # 2. API KEY SECURITY SETUP
 # ==============================================================================
+# Used when no keys are configured (OCR_API_KEYS / OCR_API_KEYS_FILE, see auth.py)
 API_KEY = "meallens@ocr"
 API_KEY_NAME = "ocr-api"
 
+KEYRING = load_keyring(default_key=API_KEY)
+KEY_LIMITER = create_limiter()
+
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 
-async def get_api_key(api_key: str = Security(api_key_header)):
-    """Dependency to validate the API key."""
-    if api_key == API_KEY:
-        return api_key
-    else:
+async def get_api_key(request: Request, api_key: str = Security(api_key_header)):
+    """
+    Dependency returning the caller's ApiKey. ApiKeyMiddleware has already
+    checked the key and its limits before the body was read; this only looks
+    the key up itself for routes outside the middleware's prefixes.
+    """
+    key = request.scope.get("state", {}).get("api_key") or KEYRING.lookup(api_key)
+    if key is None:
         raise HTTPException(
             status_code=403, detail="Could not validate credentials"
         )
+    return key
 
 # ==============================================================================
 # 3. DEFINE THE FINAL RESPONSE MODEL
@@ -39,12 +64,138 @@ class GroceryItem(BaseModel):
     confidence: int = Field(..., example=95, description="Confidence score from 0 to 100")
     amount: str = Field(..., example="6")
     unit: str = Field(..., example="pieces")
+    bbox: Optional[List[int]] = Field(
+        None, example=[12, 340, 220, 28],
+        description="Where the item was read in the uploaded image: left, top, width, height (pixels). "
+                    "Only present for OCR results.",
+    )
+
+
+class BatchItemResult(BaseModel):
+    index: int = Field(..., example=0, description="Position of the image in the batch")
+    filename: str = Field(..., example="receipt-01.jpg")
+    items: Optional[List[GroceryItem]] = Field(None, description="Present when extraction succeeded")
+    error: Optional[str] = Field(None, description="Present when extraction failed")
+
+
+class BatchResponse(BaseModel):
+    succeeded: int = Field(..., example=49)
+    failed: int = Field(..., example=1)
+    results: List[BatchItemResult]
+
+
+class ParseTextRequest(BaseModel):
+    text: Optional[str] = Field(None, example="BANANAS 1.99\n0.778 kg\nTOTAL 1.99")
+    lines: Optional[List[str]] = Field(None, example=["BANANAS 1.99", "0.778 kg", "TOTAL 1.99"])
+
+
+class ParseTextBatchRequest(BaseModel):
+    texts: List[Union[str, List[str]]] = Field(
+        ..., description="Receipt texts, each a string or a list of lines"
+    )
+
+
+class ParseTextResult(BaseModel):
+    index: int = Field(..., example=0)
+    items: Optional[List[GroceryItem]] = None
+    error: Optional[str] = None
+
+
+class ParseTextBatchResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[ParseTextResult]
+
+
+class JobResponse(BaseModel):
+    id: str = Field(..., example="3f2b9c0e8d6a4b1f9e7c5a3d1b0f2e4c")
+    status: str = Field(..., example="done", description="queued, running, done or failed")
+    attempts: int = Field(..., example=1)
+    created_at: float = Field(..., description="Unix timestamp")
+    updated_at: float = Field(..., description="Unix timestamp")
+    items: Optional[List[GroceryItem]] = Field(None, description="Present when status is done")
+    error: Optional[str] = Field(None, description="Present when status is failed")
 
 
 # ==============================================================================
 # 4. INITIALIZE THE FastAPI APP
 # ==============================================================================
+logger = logging.getLogger("ocr.api")
+
+# "0" skips the warm-up OCR call each worker makes before it accepts requests.
+OCR_WARMUP = os.environ.get("OCR_WARMUP", "1") != "0"
+# Most texts accepted by one /v1/parse_text:batch request
+PARSE_TEXT_MAX_TEXTS = int(os.environ.get("PARSE_TEXT_MAX_TEXTS", 1000))
+# Largest request bodies accepted by /v1/parse_text and /v1/parse_text:batch;
+# receipt text is small, so these are far below OCR_MAX_REQUEST_BYTES
+PARSE_TEXT_MAX_BYTES = int(os.environ.get("PARSE_TEXT_MAX_BYTES", 1024 * 1024))
+PARSE_TEXT_BATCH_MAX_BYTES = int(os.environ.get("PARSE_TEXT_BATCH_MAX_BYTES", 32 * 1024 * 1024))
+
+
+async def warm_up_pool(pool):
+    """
+    Runs one warm-up OCR call per pool worker, so no request pays for
+    loading the engine. Returns True on success; failures are logged.
+    """
+    try:
+        durations = await asyncio.gather(*(pool.run(warm_up, admit=False) for _ in range(pool.workers)))
+    except Exception:
+        logger.exception("OCR warm-up failed")
+        return False
+    logger.info("OCR warm-up done in %.0f ms (pid %d)", max(durations) * 1000, os.getpid())
+    return True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Everything below is created per worker process, after any fork; see
+    # gunicorn.conf.py for what is preloaded and shared.
+    app.state.ocr_pool = OCRPool()
+    # The server only starts accepting requests once startup has finished,
+    # so warming up here keeps cold-start latency away from clients.
+    app.state.ready = await warm_up_pool(app.state.ocr_pool) if OCR_WARMUP else True
+    app.state.result_cache = ResultCache()
+    app.state.job_queue = JobQueue()
+    loop = asyncio.get_running_loop()
+
+    def extract_in_pool(image_bytes):
+        # Called from the job threads: wait for an OCR worker like a request
+        # does, so jobs cannot push the process past OCR_WORKERS calls
+        return asyncio.run_coroutine_threadsafe(
+            app.state.ocr_pool.run(extract_grocery_items, image_bytes, admit=False), loop
+        ).result()
+
+    job_workers = [
+        JobWorker(app.state.job_queue, formatter=format_items, name=f"ocr-job-worker-{i}",
+                  extract=extract_in_pool)
+        for i in range(OCR_JOB_WORKERS)
+    ]
+    for worker in job_workers:
+        worker.start()
+    snapshot_writer = None
+    if OCR_METRICS:
+        metrics.register_state_gauges(app)
+        if metrics.OCR_METRICS_DIR:
+            snapshot_writer = metrics.SnapshotWriter()
+            snapshot_writer.start()
+    try:
+        yield
+    finally:
+        # The server has stopped accepting connections and finished the
+        # requests in flight; let running OCR and jobs complete before exiting.
+        for worker in job_workers:
+            worker.stop()
+        for worker in job_workers:
+            # A running job needs this loop to finish its OCR call
+            await asyncio.to_thread(worker.join)
+        app.state.ocr_pool.shutdown(wait=True)
+        app.state.result_cache.close()
+        if snapshot_writer is not None:
+            snapshot_writer.stop()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Grocery Receipt API",
     version="2.3-stable",
     description="""
@@ -60,53 +211,551 @@ app = FastAPI(
         "email": "foysal@example.com",
     },
 )
+# Files that are not JPEG/PNG are refused from their first bytes
+app.add_middleware(ImageSignatureMiddleware, paths=("/v1/extract_items", "/v1/jobs"))
+# Oversized bodies are refused before FastAPI parses (and spools) them
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=OCR_MAX_REQUEST_BYTES,
+    path_limits={
+        "/v1/extract_items": OCR_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+        "/v1/jobs": OCR_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+        "/v1/parse_text": PARSE_TEXT_MAX_BYTES,
+        "/v1/parse_text:batch": PARSE_TEXT_BATCH_MAX_BYTES,
+    },
+)
+# Keys and per-key limits are checked from the headers, before the body is read
+app.add_middleware(ApiKeyMiddleware, keyring=KEYRING, limiter=KEY_LIMITER)
+if OCR_METRICS:
+    app.add_middleware(metrics.MetricsMiddleware)
 
 
 # ==============================================================================
 # 5. CREATE THE PROTECTED API ENDPOINT
 # ==============================================================================
+CACHE_HEADER_NAME = "ocr-cache"
+
+
+def format_items(extracted_data, min_confidence=None):
+    """
+    Converts extract_grocery_items() output to the GroceryItem response shape,
+    leaving out items whose confidence is below min_confidence (0-100).
+    """
+    formatted_response = []
+    for item in extracted_data:
+        # THE FIX IS HERE: Multiply confidence by 100 and round to int
+        confidence_score = int(round(float(item.get("confidence", 0)) * 100))
+        if min_confidence is not None and confidence_score < min_confidence:
+            continue
+        formatted = {
+            "id": len(formatted_response) + 1,
+            "name": item.get("item_name", "Unknown Item"),
+            "confidence": confidence_score,
+            "amount": str(item.get("quantity", "0")),
+            "unit": item.get("unit", "unknown")
+        }
+        if item.get("bbox"):
+            formatted["bbox"] = item["bbox"]
+        formatted_response.append(formatted)
+    return formatted_response
+
+
+class ExtractionError(Exception):
+    """extract_grocery_items() returned an error message instead of items."""
+
+
+def resolve_preprocess(spec):
+    """Validates a `preprocess` query value, returning the ordered stage tuple."""
+    try:
+        return parse_stages(spec)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+async def run_extraction(request, contents, stages, bypass_cache=False, admit=True):
+    """
+    Returns (extracted_data, cache_status, timings) for one image, answering
+    from the result cache when possible and otherwise running OCR in the
+    worker pool. cache_status is "HIT", "MISS" or "BYPASS"; timings is empty
+    for cache hits.
+    """
+    cache = request.app.state.result_cache
+    # Hashing the image and the sqlite cache tier block; keep them off the event loop
+    key = await asyncio.to_thread(
+        cache_key, contents, PARSER_VERSION, f"{','.join(stages)}:{OCR_TARGET_WIDTH}:{OCR_CONFIG}"
+    )
+    if bypass_cache or not cache.enabled:
+        cache_status = "BYPASS"
+    else:
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            metrics.count("cache", "HIT")
+            return cached, "HIT", {}
+        cache_status = "MISS"
+    metrics.count("cache", cache_status)
+
+    # Reject non-images and decompression bombs from the header alone,
+    # before they take up an OCR worker
+    try:
+        check_image(contents)
+    except (UploadTooLarge, UnsupportedImageType):
+        metrics.count("error", "rejected")
+        raise
+
+    pool = request.app.state.ocr_pool
+    t0 = time.perf_counter()
+    try:
+        if metrics.should_profile():
+            (extracted_data, timings, info), profile = await pool.run(
+                metrics.run_profiled, extract_grocery_items_timed, contents, stages,
+                request=request, admit=admit,
+            )
+            metrics.SLOWEST.add(
+                time.perf_counter() - t0, profile,
+                path=request.url.path, image_bytes=len(contents), timings=timings, info=info,
+            )
+        else:
+            extracted_data, timings, info = await pool.run(
+                extract_grocery_items_timed, contents, stages, request=request, admit=admit
+            )
+    except PoolFull:
+        metrics.count("error", "pool_full")
+        raise
+    except (ClientDisconnected, asyncio.CancelledError):
+        metrics.count("error", "disconnected")
+        raise
+    except Exception:
+        metrics.count("error", "internal")
+        raise
+    metrics.record_extraction(timings, info, len(contents))
+
+    if isinstance(extracted_data, str):
+        metrics.count("error", "extraction")
+        raise ExtractionError(extracted_data)
+
+    if cache.enabled:
+        await asyncio.to_thread(cache.set, key, extracted_data)
+    return extracted_data, cache_status, timings
+
+
+PREPROCESS_DESCRIPTION = (
+    "Comma-separated preprocessing stages to run before OCR: resize, grayscale, "
+    "crop, deskew, threshold (or `none`). Defaults to the server's OCR_PREPROCESS setting."
+)
+MIN_CONFIDENCE_DESCRIPTION = (
+    "Leave out items with a lower confidence (0-100). Cached results are "
+    "stored unfiltered, so any threshold can be applied to them."
+)
+
+
 @app.post("/v1/extract_items",
           response_model=List[GroceryItem],
+          response_model_exclude_none=True,
           tags=["Receipt Analysis"],
           dependencies=[Depends(get_api_key)])
-async def extract_items_from_receipt(image: UploadFile = File(...)):
+async def extract_items_from_receipt(
+    request: Request,
+    response: Response,
+    image: UploadFile = File(...),
+    preprocess: Optional[str] = Query(None, description=PREPROCESS_DESCRIPTION),
+    min_confidence: Optional[int] = Query(None, ge=0, le=100, description=MIN_CONFIDENCE_DESCRIPTION),
+    ocr_cache: Optional[str] = Header(
+        None, alias=CACHE_HEADER_NAME,
+        description="Send `bypass` to ignore any cached result and run OCR again.",
+    ),
+):
     """
     Accepts an image file (JPG/PNG), processes it to find grocery items,
     and returns a structured list of those items. Requires API key authentication.
-    """
-    temp_filename = f"temp_{uuid.uuid4()}{os.path.splitext(image.filename)[1]}"
 
+    OCR runs in a worker pool; when the pool and its queue are full the request
+    is rejected with 503 and a Retry-After header. Results are cached by image
+    content, so re-uploading the same photo does not run OCR again; the
+    `X-Cache` response header tells whether the result came from the cache.
+    """
+    stages = resolve_preprocess(preprocess)
     try:
-        contents = await image.read()
-        with open(temp_filename, "wb") as f:
-            f.write(contents)
-
-        extracted_data = extract_grocery_items(temp_filename)
-        
-        if isinstance(extracted_data, str):
-            raise HTTPException(status_code=400, detail=extracted_data)
-
-        formatted_response = []
-        for i, item in enumerate(extracted_data):
-            # THE FIX IS HERE: Multiply confidence by 100 and round to int
-            confidence_score = int(round(float(item.get("confidence", 0)) * 100))
-            formatted_response.append({
-                "id": i + 1,
-                "name": item.get("item_name", "Unknown Item"),
-                "confidence": confidence_score,
-                "amount": str(item.get("quantity", "0")),
-                "unit": item.get("unit", "unknown")
-            })
-
-        return formatted_response
+        # The upload is held in memory (see uploads.py) and decoded from there.
+        t0 = time.perf_counter()
+        contents = await read_upload(image)
+        upload_ms = round((time.perf_counter() - t0) * 1000, 2)
+        metrics.record_extraction({"upload_ms": upload_ms}, {})
+
+        extracted_data, cache_status, timings = await run_extraction(
+            request, contents, stages, bypass_cache=ocr_cache == "bypass"
+        )
+        response.headers["X-Cache"] = cache_status
+        if OCR_SERVER_TIMING:
+            response.headers["Server-Timing"] = metrics.server_timing(
+                {"upload_ms": upload_ms, **timings}, cache_status
+            )
+        return format_items(extracted_data, min_confidence)
 
+    except ExtractionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImageType as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except PoolFull as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)}
+        )
+    except ClientDisconnected:
+        # Nobody is listening any more; 499 is the conventional "client closed request".
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    except HTTPException:
+        raise
     except Exception as e:
         # This will now catch validation errors earlier if they happen
         raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
 
-    finally:
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+# Images read and in progress at once per batch or streaming request; this is
+# what bounds the memory a request can use, however many images it contains.
+OCR_STREAM_WINDOW = int(os.environ.get("OCR_STREAM_WINDOW", OCR_WORKERS * 2))
+
+
+async def extract_batch_entry(request, index, filename, reader, stages, bypass_cache=False, started_at=None,
+                              min_confidence=None):
+    """
+    Processes one image of a batch and returns its result dict. Extraction
+    errors are reported in the "error" field instead of being raised.
+    """
+    t0 = time.perf_counter()
+    result = {"index": index, "filename": filename or f"image-{index}"}
+    try:
+        # Archive members are decompressed here, off the event loop
+        contents = await asyncio.to_thread(reader)
+        extracted_data, cache_status, timings = await run_extraction(
+            request, contents, stages, bypass_cache=bypass_cache, admit=False
+        )
+        result["items"] = format_items(extracted_data, min_confidence)
+        result["cache"] = cache_status
+        result["timings"] = timings
+    except (ClientDisconnected, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        result["error"] = str(e)
+    t1 = time.perf_counter()
+    result["duration_ms"] = round((t1 - t0) * 1000, 1)
+    if started_at is not None:
+        result["elapsed_ms"] = round((t1 - started_at) * 1000, 1)
+    return result
+
+
+@app.post("/v1/extract_items:batch",
+          response_model=BatchResponse,
+          response_model_exclude_none=True,
+          tags=["Receipt Analysis"],
+          dependencies=[Depends(get_api_key)])
+async def extract_items_batch(
+    request: Request,
+    images: List[UploadFile] = File(..., description="Receipt images (JPG/PNG) and/or zip/tar archives of them"),
+    preprocess: Optional[str] = Query(None, description=PREPROCESS_DESCRIPTION),
+    min_confidence: Optional[int] = Query(None, ge=0, le=100, description=MIN_CONFIDENCE_DESCRIPTION),
+    ocr_cache: Optional[str] = Header(None, alias=CACHE_HEADER_NAME),
+):
+    """
+    Extracts items from many receipts in one request. Each part of the
+    multipart body may be an image or a zip/tar archive of images, up to
+    OCR_BATCH_MAX_IMAGES images in total (100 by default).
+
+    Images are processed in parallel across the OCR worker pool, but only
+    OCR_STREAM_WINDOW of them are read into memory at a time. Every image
+    gets its own entry in `results`, in upload order, with either `items`
+    or `error` set. A failing image does not fail the batch.
+    """
+    pool = request.app.state.ocr_pool
+    stages = resolve_preprocess(preprocess)
+    try:
+        # Listing the images of a compressed tar means decompressing it
+        entries = await asyncio.to_thread(list, iter_batch_images(images))
+        # The batch is admitted as a whole; its images then queue for workers.
+        pool.admit()
+    except TooManyImages as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except PoolFull as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)}
+        )
+
+    window = asyncio.Semaphore(OCR_STREAM_WINDOW)
+
+    async def bounded_entry(index, name, reader):
+        async with window:
+            return await extract_batch_entry(
+                request, index, name, reader, stages, bypass_cache=ocr_cache == "bypass",
+                min_confidence=min_confidence,
+            )
+
+    try:
+        results = await asyncio.gather(*(bounded_entry(i, name, reader) for i, (name, reader) in enumerate(entries)))
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client disconnected")
+
+    failed = sum(1 for r in results if "error" in r)
+    return {"succeeded": len(results) - failed, "failed": failed, "results": results}
+
+
+def encode_stream_event(event, data, fmt):
+    payload = json.dumps(data, separators=(",", ":"))
+    if fmt == "sse":
+        return f"event: {event}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+@app.post("/v1/extract_items:stream",
+          tags=["Receipt Analysis"],
+          dependencies=[Depends(get_api_key)],
+          responses={200: {"content": {"application/x-ndjson": {}, "text/event-stream": {}}}})
+async def extract_items_stream(
+    request: Request,
+    images: List[UploadFile] = File(..., description="Receipt images (JPG/PNG) and/or zip/tar archives of them"),
+    stream_format: str = Query("ndjson", alias="format", pattern="^(ndjson|sse)$", description="`ndjson` or `sse`"),
+    preprocess: Optional[str] = Query(None, description=PREPROCESS_DESCRIPTION),
+    min_confidence: Optional[int] = Query(None, ge=0, le=100, description=MIN_CONFIDENCE_DESCRIPTION),
+    ocr_cache: Optional[str] = Header(None, alias=CACHE_HEADER_NAME),
+):
+    """
+    Like the batch endpoint, but streams one result per image as soon as it
+    is ready, as NDJSON lines or Server-Sent Events. Results arrive in
+    completion order; use `index` to match them to uploads. Each result has
+    the same fields as a batch result plus `duration_ms` (time spent on that
+    image), `elapsed_ms` (time since the stream started) and `timings`
+    (per-stage durations: decode, preprocessing, OCR, parse). A final `done`
+    event carries the totals.
+
+    Only OCR_STREAM_WINDOW images are read and processed at a time, so
+    there is no limit on the number of images in a stream.
+    """
+    pool = request.app.state.ocr_pool
+    stages = resolve_preprocess(preprocess)
+    try:
+        pool.admit()
+    except PoolFull as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)}
+        )
+
+    bypass_cache = ocr_cache == "bypass"
+    started_at = time.perf_counter()
+
+    async def results():
+        entries = iter_batch_images(images, max_images=None)
+        pending = set()
+        index = succeeded = failed = 0
+        try:
+            while True:
+                # Keep the window full, reading each image only when it is scheduled
+                while entries is not None and len(pending) < OCR_STREAM_WINDOW:
+                    try:
+                        entry = await asyncio.to_thread(next, entries, None)
+                    except Exception as e:
+                        # The uploads cannot be read any further: report that as
+                        # one more failed entry and finish the images in flight
+                        logger.warning("Stopped reading stream uploads: %s", e)
+                        entries = None
+                        failed += 1
+                        yield encode_stream_event("result", {
+                            "index": index, "filename": f"image-{index}", "error": str(e),
+                        }, stream_format)
+                        break
+                    if entry is None:
+                        entries = None
+                        break
+                    name, reader = entry
+                    pending.add(asyncio.ensure_future(extract_batch_entry(
+                        request, index, name, reader, stages, bypass_cache=bypass_cache, started_at=started_at,
+                        min_confidence=min_confidence,
+                    )))
+                    index += 1
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if "error" in result:
+                        failed += 1
+                    else:
+                        succeeded += 1
+                    yield encode_stream_event("result", result, stream_format)
+        except ClientDisconnected:
+            return
+        finally:
+            for task in pending:
+                task.cancel()
+
+        yield encode_stream_event("done", {
+            "done": True,
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 1),
+        }, stream_format)
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(results(), media_type=media_type)
+
+
+@app.post("/v1/parse_text",
+          response_model=List[GroceryItem],
+          response_model_exclude_none=True,
+          tags=["Text Parsing"],
+          dependencies=[Depends(get_api_key)])
+async def parse_text(body: ParseTextRequest):
+    """
+    Parses receipt text you already have (as `text` or as `lines`) into the
+    same items /v1/extract_items returns, without running OCR.
+    """
+    if (body.text is None) == (body.lines is None):
+        raise HTTPException(status_code=422, detail="Send exactly one of 'text' or 'lines'.")
+    # A long text takes a while to parse, so keep it off the event loop
+    result = await asyncio.to_thread(parse_receipt_text, body.text if body.text is not None else body.lines)
+    if isinstance(result, str):
+        raise HTTPException(status_code=400, detail=result)
+    return format_items(result)
+
+
+def _parse_texts(texts):
+    results = []
+    for i, text in enumerate(texts):
+        result = parse_receipt_text(text)
+        if isinstance(result, str):
+            results.append({"index": i, "error": result})
+        else:
+            results.append({"index": i, "items": format_items(result)})
+    return results
+
+
+@app.post("/v1/parse_text:batch",
+          response_model=ParseTextBatchResponse,
+          response_model_exclude_none=True,
+          tags=["Text Parsing"],
+          dependencies=[Depends(get_api_key)])
+async def parse_text_batch(body: ParseTextBatchRequest):
+    """
+    Parses many receipt texts in one request. Every text gets its own entry
+    in `results`, in request order, with either `items` or `error` set.
+    """
+    if len(body.texts) > PARSE_TEXT_MAX_TEXTS:
+        raise HTTPException(
+            status_code=413, detail=f"A batch may contain at most {PARSE_TEXT_MAX_TEXTS} texts."
+        )
+    # Large batches take a while in total, so keep them off the event loop
+    results = await asyncio.to_thread(_parse_texts, body.texts)
+    failed = sum(1 for r in results if "error" in r)
+    return {"succeeded": len(results) - failed, "failed": failed, "results": results}
+
+
+@app.post("/v1/jobs",
+          response_model=JobResponse,
+          response_model_exclude_none=True,
+          status_code=202,
+          tags=["Jobs"])
+async def create_job(
+    request: Request,
+    response: Response,
+    key=Depends(get_api_key),
+    image: UploadFile = File(...),
+    callback_url: Optional[str] = Form(None, description="Optional URL that receives the finished job as a JSON POST"),
+):
+    """
+    Queues a receipt for background extraction and returns immediately.
+    Poll GET /v1/jobs/{id} (also given in the Location header) for the
+    result, or pass `callback_url` to have it POSTed to you when it is done.
+    """
+    if callback_url:
+        try:
+            # Resolves the host name, so off the event loop
+            await asyncio.to_thread(check_callback_url, callback_url)
+        except InvalidCallbackUrl as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    try:
+        contents = await read_upload(image)
+        check_image(contents)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImageType as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+    queue = request.app.state.job_queue
+    job_id = await asyncio.to_thread(queue.enqueue, contents, callback_url, key.name)
+    job = await asyncio.to_thread(queue.get, job_id)
+    response.headers["Location"] = f"/v1/jobs/{job_id}"
+    return job_to_response(job)
+
+
+@app.get("/v1/jobs/{job_id}",
+         response_model=JobResponse,
+         response_model_exclude_none=True,
+         tags=["Jobs"])
+async def get_job(request: Request, job_id: str, key=Depends(get_api_key)):
+    """
+    Returns the status of a job and, once it is done, its items. Jobs can
+    only be read with the API key that created them.
+    """
+    job = await asyncio.to_thread(request.app.state.job_queue.get, job_id, key.name)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_response(job)
+
+
+@app.get("/v1/cache/stats", tags=["Monitoring"], dependencies=[Depends(get_api_key)])
+async def cache_stats(request: Request):
+    """Returns hit/miss counters for the OCR result cache."""
+    return request.app.state.result_cache.stats()
+
+
+@app.get("/v1/usage", tags=["Monitoring"])
+async def key_usage(key=Depends(get_api_key)):
+    """
+    Request counters for the calling API key: requests accepted and
+    rejected by its rate and concurrency limits, and requests in progress.
+    Shared by all worker processes when OCR_KEY_DB is set, otherwise for
+    the worker that answers.
+    """
+    if KEY_LIMITER.blocking:
+        usage = await asyncio.to_thread(KEY_LIMITER.usage, key.name)
+    else:
+        usage = KEY_LIMITER.usage(key.name)
+    return {
+        "key": key.name,
+        "limits": {"rate_per_minute": key.rate, "burst": key.burst, "concurrency": key.concurrency},
+        **usage,
+    }
+
+
+@app.get("/metrics", tags=["Monitoring"], response_class=PlainTextResponse, include_in_schema=OCR_METRICS)
+async def prometheus_metrics():
+    """
+    Prometheus metrics in the text exposition format: of every worker process
+    when OCR_METRICS_DIR is set, of the one that answers otherwise.
+    """
+    if not OCR_METRICS:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (OCR_METRICS=0)")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/slowest", tags=["Monitoring"], dependencies=[Depends(get_api_key)])
+async def slowest_requests():
+    """
+    The slowest OCR calls captured by the sampling profiler, slowest first,
+    each with its cProfile summary. Empty unless OCR_PROFILE_RATE is set.
+    """
+    return metrics.SLOWEST.slowest()
+
+
+@app.get("/ready", tags=["Health Check"])
+async def ready(request: Request, response: Response):
+    """
+    Readiness check for load balancers: 200 once this worker has finished
+    its OCR warm-up, 503 if warm-up failed.
+    """
+    is_ready = getattr(request.app.state, "ready", False)
+    if not is_ready:
+        response.status_code = 503
+    return {"ready": is_ready, "pid": os.getpid()}
+
 
 @app.get("/", tags=["Health Check"])
 async def root():
@@ -0,0 +1,445 @@
+# metrics.py
+
+import cProfile
+import glob
+import heapq
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+
+
+# --- Configuration ---
+# OCR_METRICS: "0" turns off metric collection and the /metrics endpoint; the
+#   request path then skips all instrumentation.
+# OCR_SERVER_TIMING: "1" adds a Server-Timing header with the per-stage
+#   durations to extraction responses (visible in browser dev tools).
+# OCR_PROFILE_RATE: fraction of OCR calls (0-1) run under cProfile. The
+#   slowest profiled calls are kept and served on /metrics/slowest.
+# OCR_PROFILE_KEEP: how many of the slowest profiles are kept.
+# OCR_METRICS_DIR: directory shared by the worker processes of one server
+#   (gunicorn.conf.py creates one). Each worker writes its metrics there and
+#   /metrics adds up the counters and histograms of all workers; unset,
+#   /metrics covers only the process that answers.
+# OCR_METRICS_FLUSH: seconds between writes of a worker's metrics to
+#   OCR_METRICS_DIR.
+OCR_METRICS = os.environ.get("OCR_METRICS", "1") != "0"
+OCR_SERVER_TIMING = os.environ.get("OCR_SERVER_TIMING", "0") == "1"
+OCR_PROFILE_RATE = float(os.environ.get("OCR_PROFILE_RATE", 0))
+OCR_PROFILE_KEEP = int(os.environ.get("OCR_PROFILE_KEEP", 10))
+OCR_METRICS_DIR = os.environ.get("OCR_METRICS_DIR") or None
+OCR_METRICS_FLUSH = float(os.environ.get("OCR_METRICS_FLUSH", 5))
+# Lines of pstats output kept per profile.
+PROFILE_LINES = 40
+
+# Histogram buckets
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+PIXELS_BUCKETS = (320, 640, 1200, 2000, 3000, 4000, 6000)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.labels, lv), v) for lv, v in sorted(self._values.items())]
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, Prometheus style."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        self._values = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((lv, list(c)) for lv, c in self._values.items())
+        samples = []
+        for label_values, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(bound)
+                labels = _format_labels(self.labels + ("le",), label_values + (le,))
+                samples.append((self.name + "_bucket", labels, cumulative))
+            labels = _format_labels(self.labels, label_values)
+            samples.append((self.name + "_sum", labels, counts[-1]))
+            samples.append((self.name + "_count", labels, cumulative))
+        return samples
+
+
+class Gauge:
+    """A value read at scrape time from `fn`, which returns {label values: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labels=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+
+    def samples(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return []
+        return [(self.name, _format_labels(self.labels, lv), v) for lv, v in sorted(values.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        """{metric name: [[sample name, labels, value], ...]} of every metric."""
+        return {name: [list(sample) for sample in metric.samples()] for name, metric in self._metrics.items()}
+
+    def render(self, others=()):
+        """
+        All metrics in the Prometheus text exposition format. `others` are
+        (pid, snapshot) pairs of other worker processes: their counter and
+        histogram samples are added to ours, and their gauges are listed
+        with a `worker` label, as is our own gauge when there are others.
+        """
+        out = []
+        pid = os.getpid()
+        for metric in self._metrics.values():
+            out.append(f"# HELP {metric.name} {metric.help}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            if metric.kind == "gauge" and others:
+                sources = [(pid, metric.samples())] + [(p, snap.get(metric.name, ())) for p, snap in others]
+                for worker, samples in sources:
+                    for name, labels, value in samples:
+                        out.append(f"{name}{_with_worker(labels, worker)} {_format_value(value)}")
+                continue
+            totals = {}
+            for name, labels, value in metric.samples():
+                totals[name, labels] = value
+            for _, snap in others:
+                for name, labels, value in snap.get(metric.name, ()):
+                    totals[name, labels] = totals.get((name, labels), 0) + value
+            for (name, labels), value in totals.items():
+                out.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(out) + "\n"
+
+
+def _with_worker(labels, worker):
+    inner = labels[1:-1]
+    return "{" + f'worker="{worker}"' + ("," + inner if inner else "") + "}"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "ocr_http_requests_total", "HTTP requests by route, method and status code.",
+    labels=("route", "method", "status"),
+))
+HTTP_DURATION = REGISTRY.register(Histogram(
+    "ocr_http_request_duration_seconds", "Time to produce the HTTP response, by route.",
+    SECONDS_BUCKETS, labels=("route",),
+))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "ocr_stage_duration_seconds",
+    "Time spent per extraction stage (upload, decode, preprocessing steps, ocr, parse).",
+    SECONDS_BUCKETS, labels=("stage",),
+))
+IMAGE_BYTES = REGISTRY.register(Histogram(
+    "ocr_image_bytes", "Size of uploaded images.", BYTES_BUCKETS,
+))
+IMAGE_PIXELS = REGISTRY.register(Histogram(
+    "ocr_image_dimension_pixels", "Width and height of uploaded images.", PIXELS_BUCKETS, labels=("dimension",),
+))
+LINES_PARSED = REGISTRY.register(Histogram(
+    "ocr_lines_parsed", "Text lines produced by OCR per image.", COUNT_BUCKETS,
+))
+ITEMS_FOUND = REGISTRY.register(Histogram(
+    "ocr_items_found", "Grocery items extracted per image.", COUNT_BUCKETS,
+))
+CACHE_RESULTS = REGISTRY.register(Counter(
+    "ocr_cache_lookups_total", "Result cache lookups by outcome (HIT, MISS, BYPASS).", labels=("result",),
+))
+ERRORS = REGISTRY.register(Counter(
+    "ocr_errors_total",
+    "Failed extractions by kind (rejected, extraction, pool_full, disconnected, internal).",
+    labels=("kind",),
+))
+
+KEY_REQUESTS = REGISTRY.register(Counter(
+    "ocr_api_key_requests_total",
+    "Authenticated requests by API key name and outcome (accepted, rate_limited, concurrency_limited).",
+    labels=("key", "outcome"),
+))
+
+
+def register_state_gauges(app):
+    """Gauges for the OCR pool, result cache and job queue of a running app."""
+    state = app.state
+    REGISTRY.register(Gauge(
+        "ocr_pool_jobs", "OCR calls running in the pool or waiting for a worker.",
+        lambda: {("running",): state.ocr_pool.in_flight, ("waiting",): state.ocr_pool.waiting},
+        labels=("state",),
+    ))
+    REGISTRY.register(Gauge(
+        "ocr_pool_capacity", "Workers plus queue slots in the OCR pool.",
+        lambda: {(): state.ocr_pool.capacity},
+    ))
+    REGISTRY.register(Gauge(
+        "ocr_cache_entries", "Results held in the in-memory cache.",
+        lambda: {(): state.result_cache.stats()["entries"]},
+    ))
+    REGISTRY.register(Gauge(
+        "ocr_jobs", "Background jobs by status.",
+        lambda: {(status,): count for status, count in state.job_queue.counts().items()},
+        labels=("status",),
+    ))
+
+
+def count(kind, label):
+    """Counts a cache lookup ("cache", outcome) or a failure ("error", kind)."""
+    if OCR_METRICS:
+        (CACHE_RESULTS if kind == "cache" else ERRORS).inc(label)
+
+
+def count_key(name, outcome):
+    """Counts a request made with API key `name` and what the limiter decided."""
+    if OCR_METRICS:
+        KEY_REQUESTS.inc(name, outcome)
+
+
+def record_extraction(timings, info, image_bytes=None):
+    """Records the stage timings and image/parse figures of one OCR run."""
+    if not OCR_METRICS:
+        return
+    for key, ms in timings.items():
+        STAGE_DURATION.observe(ms / 1000, key[:-3])
+    if image_bytes is not None:
+        IMAGE_BYTES.observe(image_bytes)
+    if "width" in info:
+        IMAGE_PIXELS.observe(info["width"], "width")
+        IMAGE_PIXELS.observe(info["height"], "height")
+    if "lines" in info:
+        LINES_PARSED.observe(info["lines"])
+    if "items" in info:
+        ITEMS_FOUND.observe(info["items"])
+
+
+def server_timing(timings, cache_status=None):
+    """Formats stage timings ({"ocr_ms": 12.3, ...}) as a Server-Timing header value."""
+    parts = [f"{key[:-3]};dur={ms}" for key, ms in timings.items()]
+    if cache_status:
+        parts.append(f'cache;desc="{cache_status}"')
+    return ", ".join(parts)
+
+
+# ==============================================================================
+# Metrics of several worker processes
+# ==============================================================================
+def _snapshot_path(pid):
+    return os.path.join(OCR_METRICS_DIR, f"{pid}.json")
+
+
+def write_snapshot():
+    """Writes this process's metrics to OCR_METRICS_DIR, replacing its last write."""
+    if not (OCR_METRICS and OCR_METRICS_DIR):
+        return
+    path = _snapshot_path(os.getpid())
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.replace(tmp, path)
+
+
+def _read_snapshots():
+    """(pid, snapshot) of every other process that wrote to OCR_METRICS_DIR."""
+    snapshots = []
+    for path in glob.glob(os.path.join(OCR_METRICS_DIR, "*.json")):
+        pid = os.path.basename(path)[:-5]
+        if pid == str(os.getpid()):
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append((pid, json.load(f)))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def render():
+    """/metrics output: this process, plus every other worker when OCR_METRICS_DIR is set."""
+    return REGISTRY.render(_read_snapshots() if OCR_METRICS_DIR else ())
+
+
+def mark_process_dead(pid):
+    """
+    Called in the gunicorn master when a worker exits. Its counters and
+    histograms stay in the totals; its gauges, which described a process
+    that no longer exists, are dropped.
+    """
+    if not OCR_METRICS_DIR:
+        return
+    path = _snapshot_path(pid)
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return
+    # Gauges are registered by each worker's app, so here only the counters
+    # and histograms are known
+    kept = {name for name, metric in REGISTRY._metrics.items() if metric.kind != "gauge"}
+    snapshot = {name: samples for name, samples in snapshot.items() if name in kept}
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(path + ".tmp", path)
+
+
+class SnapshotWriter(threading.Thread):
+    """Writes this process's metrics to OCR_METRICS_DIR every `interval` seconds."""
+
+    def __init__(self, interval=OCR_METRICS_FLUSH):
+        super().__init__(name="ocr-metrics-writer", daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                write_snapshot()
+            except OSError:
+                pass
+
+    def stop(self):
+        """Stops the thread and writes the final figures."""
+        self._stop_event.set()
+        write_snapshot()
+
+
+# ==============================================================================
+# Sampling profiler
+# ==============================================================================
+def should_profile():
+    return OCR_METRICS and OCR_PROFILE_RATE > 0 and random.random() < OCR_PROFILE_RATE
+
+
+def run_profiled(fn, *args):
+    """
+    Runs fn(*args) under cProfile and returns (result, profile_text).
+    Module-level so it can be sent to a process pool.
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(fn, *args)
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+    return result, out.getvalue()
+
+
+class SlowestProfiles:
+    """Keeps the `keep` slowest profiled calls."""
+
+    def __init__(self, keep=OCR_PROFILE_KEEP):
+        self.keep = keep
+        self._heap = []  # (duration, seq, entry); smallest duration on top
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def add(self, duration, profile, **details):
+        entry = {"duration_ms": round(duration * 1000, 1), "at": time.time(), **details, "profile": profile}
+        with self._lock:
+            self._seq += 1
+            item = (duration, self._seq, entry)
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, item)
+            elif duration > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def slowest(self):
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._heap, reverse=True)]
+
+
+SLOWEST = SlowestProfiles()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them until the last byte of
+    the response is sent, so streamed responses are measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Label by route template, not the raw path, to keep the label set small
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.inc(route, scope["method"], status[0])
+            HTTP_DURATION.observe(time.perf_counter() - t0, route)
@@ -0,0 +1,151 @@
+# ocr_pool.py
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# --- Configuration ---
+# All settings can be overridden with environment variables.
+# OCR_EXECUTOR: "thread" (default) or "process". pytesseract spends its time in a
+# tesseract subprocess, so threads already use every core; "process" also moves
+# the Python parsing off the API process.
+OCR_EXECUTOR = os.environ.get("OCR_EXECUTOR", "thread").lower()
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", os.cpu_count() or 1))
+# Maximum number of requests waiting for a free worker before we start rejecting.
+OCR_MAX_QUEUE = int(os.environ.get("OCR_MAX_QUEUE", OCR_WORKERS * 4))
+# Seconds a rejected client is told to wait before retrying.
+OCR_RETRY_AFTER = int(os.environ.get("OCR_RETRY_AFTER", 2))
+# How often (seconds) a waiting request checks whether its client is still connected.
+DISCONNECT_POLL_INTERVAL = 0.25
+
+
+class PoolFull(Exception):
+    """Raised when both the workers and the wait queue are full."""
+
+    def __init__(self, retry_after=OCR_RETRY_AFTER):
+        super().__init__("The OCR service is busy. Please retry later.")
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away before its OCR job finished."""
+
+
+class OCRPool:
+    """
+    Runs blocking OCR calls in a thread or process pool so the event loop stays free.
+
+    At most `workers` calls run at once and at most `max_queue` more may wait for a
+    slot; anything beyond that is rejected immediately with PoolFull. The counters
+    are only touched from the event loop thread, so they need no locking.
+    """
+
+    def __init__(self, workers=OCR_WORKERS, max_queue=OCR_MAX_QUEUE, executor=OCR_EXECUTOR):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"OCR_EXECUTOR must be 'thread' or 'process', not '{executor}'")
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.executor_kind = executor
+        if executor == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+        self._slots = asyncio.Semaphore(self.workers)
+        self.in_flight = 0
+        self.waiting = 0
+
+    @property
+    def capacity(self):
+        return self.workers + self.max_queue
+
+    def is_full(self):
+        return self.in_flight + self.waiting >= self.capacity
+
+    def admit(self):
+        """Raises PoolFull unless there is room for at least one more job."""
+        if self.is_full():
+            raise PoolFull()
+
+    async def run(self, fn, *args, request=None, admit=True):
+        """
+        Runs fn(*args) in the pool and returns its result.
+
+        Raises PoolFull if there is no room left, and ClientDisconnected if
+        `request` (a Starlette Request) disconnects while the job is pending.
+        Pass admit=False for jobs of a batch that was already admitted as a
+        whole with admit(); those always wait for a worker.
+        """
+        if admit:
+            self.admit()
+
+        self.waiting += 1
+        acquire = asyncio.ensure_future(self._slots.acquire())
+        try:
+            await self._wait_for(acquire, request)
+        except BaseException:
+            # The slot may have been handed to us just as we gave up waiting
+            if acquire.done() and not acquire.cancelled() and acquire.exception() is None:
+                self._slots.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        release_now = True
+        try:
+            future = self._executor.submit(fn, *args)
+            try:
+                return await self._wait_for(asyncio.wrap_future(future), request)
+            except BaseException:
+                # Only jobs that have not started yet can actually be stopped. A
+                # running one keeps its slot until it finishes, so disconnecting
+                # clients cannot get more than `workers` calls running at once.
+                if not future.cancel() and not future.done():
+                    release_now = False
+                    loop = asyncio.get_running_loop()
+                    future.add_done_callback(lambda _: self._release_from_thread(loop))
+                raise
+        finally:
+            if release_now:
+                self._release()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def _release_from_thread(self, loop):
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            pass  # the event loop is closed; so is this pool
+
+    async def _wait_for(self, awaitable, request):
+        """Awaits `awaitable`, giving up early if the client disconnects."""
+        if request is None:
+            return await awaitable
+
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+                if done:
+                    return task.result()
+                if await request.is_disconnected():
+                    raise ClientDisconnected()
+        except BaseException:
+            if not task.done():
+                task.cancel()
+            raise
+
+    def stats(self):
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,152 @@
+# preprocess.py
+
+import os
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+# --- Configuration ---
+# OCR_PREPROCESS: comma-separated stages applied before OCR when a request does
+#   not choose its own. Use "none" to send the photo to Tesseract untouched.
+# OCR_TARGET_WIDTH: images wider than this (pixels) are downscaled to it. Around
+#   1200px keeps receipt text at roughly 300 DPI, which is what Tesseract wants.
+OCR_PREPROCESS = os.environ.get("OCR_PREPROCESS", "resize,grayscale")
+OCR_TARGET_WIDTH = int(os.environ.get("OCR_TARGET_WIDTH", 1200))
+
+# Stages always run in this order, whatever order they were requested in.
+STAGES = ("resize", "grayscale", "crop", "deskew", "threshold")
+
+# Skew angles (degrees) outside this range are assumed to be detection errors.
+MAX_SKEW = 15.0
+
+
+def parse_stages(spec):
+    """
+    Turns "grayscale,resize" (or a list) into an ordered tuple of stage names.
+    None means the configured default; "" or "none" means no preprocessing.
+    Raises ValueError for unknown stage names.
+    """
+    if spec is None:
+        spec = OCR_PREPROCESS
+    if isinstance(spec, str):
+        spec = [s.strip().lower() for s in spec.split(",")]
+    requested = {s for s in spec if s and s != "none"}
+    unknown = requested - set(STAGES)
+    if unknown:
+        raise ValueError(
+            f"Unknown preprocessing stage(s): {', '.join(sorted(unknown))}. "
+            f"Valid stages: {', '.join(STAGES)}"
+        )
+    return tuple(s for s in STAGES if s in requested)
+
+
+def resize(img, target_width=None):
+    """Downscales (never upscales) so the image is at most target_width wide."""
+    target_width = target_width or OCR_TARGET_WIDTH
+    h, w = img.shape[:2]
+    if w <= target_width:
+        return img
+    scale = target_width / w
+    return cv2.resize(img, (target_width, max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def grayscale(img):
+    if img.ndim == 2:
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+
+
+def crop_region(img):
+    """
+    Crops to the receipt: the largest bright region, which is the paper
+    against a darker background. Returns (image, (x, y)), the crop and its
+    top-left corner in `img`; the image is left alone, at (0, 0), if no
+    clear receipt outline is found.
+    """
+    gray = grayscale(img)
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return img, (0, 0)
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    # A tiny region is noise, and a region covering the whole photo means the
+    # receipt already fills the frame.
+    area = w * h
+    total = gray.shape[0] * gray.shape[1]
+    if area < 0.2 * total or area > 0.95 * total:
+        return img, (0, 0)
+    return img[y:y + h, x:x + w], (x, y)
+
+
+def crop(img):
+    """Crops to the receipt (see crop_region)."""
+    return crop_region(img)[0]
+
+
+def deskew(img):
+    """Rotates the image so text lines are horizontal."""
+    gray = grayscale(img)
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    coords = cv2.findNonZero(ink)
+    if coords is None:
+        return img
+    angle = cv2.minAreaRect(coords)[-1]
+    # OpenCV versions disagree on the range minAreaRect reports ([-90, 0) or
+    # (0, 90]); the rectangle is the same modulo 90, so fold into [-45, 45).
+    angle = (angle + 45) % 90 - 45
+    if abs(angle) < 0.1 or abs(angle) > MAX_SKEW:
+        return img
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def threshold(img):
+    """Adaptive binarization; evens out shadows and uneven lighting."""
+    gray = grayscale(img)
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+
+
+STAGE_FUNCTIONS = {
+    "resize": resize,
+    "grayscale": grayscale,
+    "crop": crop,
+    "deskew": deskew,
+    "threshold": threshold,
+}
+
+
+def preprocess_image(img, stages=None, timings=None, origin=None):
+    """
+    Runs the given stages (see parse_stages) on a PIL image and returns a PIL
+    image ready for Tesseract. If `timings` is a dict, each stage's duration
+    is stored in it as "<stage>_ms". If `origin` is a dict, it gets what is
+    needed to map positions back to the input image: "offset", the (x, y)
+    of the crop in the (resized) image, and "rotated", True if deskew
+    turned the image.
+    """
+    stages = parse_stages(stages)
+    if not stages:
+        return img
+
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    arr = np.asarray(img)
+    for stage in stages:
+        t0 = time.perf_counter()
+        if stage == "crop":
+            arr, offset = crop_region(arr)
+            if origin is not None:
+                origin["offset"] = offset
+        else:
+            before = arr
+            arr = STAGE_FUNCTIONS[stage](arr)
+            if stage == "deskew" and origin is not None and arr is not before:
+                origin["rotated"] = True
+        if timings is not None:
+            timings[f"{stage}_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return Image.fromarray(arr)
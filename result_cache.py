@@ -0,0 +1,144 @@
+# result_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# --- Configuration ---
+# OCR_CACHE_SIZE: max number of results kept in memory (0 disables the cache).
+# OCR_CACHE_TTL: seconds a cached result stays valid.
+# OCR_CACHE_DB: optional sqlite file for a second tier that survives restarts.
+OCR_CACHE_SIZE = int(os.environ.get("OCR_CACHE_SIZE", 1024))
+OCR_CACHE_TTL = float(os.environ.get("OCR_CACHE_TTL", 24 * 3600))
+OCR_CACHE_DB = os.environ.get("OCR_CACHE_DB", "")
+
+logger = logging.getLogger("ocr.cache")
+
+
+def cache_key(image_bytes, version, options=""):
+    """
+    Content-addressed key: the same image bytes parsed by the same parser
+    version (and options) always map to the same key.
+    """
+    h = hashlib.sha256()
+    h.update(f"{version}\0{options}\0".encode())
+    h.update(image_bytes)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier result cache: an in-process LRU with a TTL, optionally backed by
+    a sqlite file. Values must be JSON-serializable.
+
+    The sqlite tier may be shared by several processes. Its calls block, so
+    callers on an event loop should run get() and set() in a thread. If the
+    file cannot be read or written (e.g. it stays locked), the lookup counts
+    as a miss and the result is only kept in memory.
+    """
+
+    def __init__(self, max_entries=OCR_CACHE_SIZE, ttl=OCR_CACHE_TTL, db_path=OCR_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            # Readers in other processes do not block on a writer
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_expires ON results (expires_at)")
+            self._db.commit()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or self._db is not None
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        row = None
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    row = self._db.execute(
+                        "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+                    ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("Result cache read failed: %s", e)
+        with self._lock:
+            if row is not None and row[1] > now:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value), expires_at),
+                    )
+                    self._db.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            # The result is still served from memory; only persistence is lost
+            logger.warning("Result cache write failed: %s", e)
+
+    def _remember(self, key, value, expires_at):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "persistent": self._db is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
@@ -1,49 +1,43 @@
 # sample_client.py
+#
+# Minimal example: send one receipt to the API and print the items.
+# For whole folders of receipts use the client's command line instead:
+#   python client.py receipts/ --out results.jsonl
 
-import requests
 import json
+import os
+import sys
+
+import httpx
+
+from client import OcrClient, ApiError
+
+# --- Configuration ---
+API_URL = os.environ.get("OCR_API_URL", "http://127.0.0.1:8000")
+API_KEY = os.environ.get("OCR_API_KEY", "meallens@ocr")
 
-# --- Configuration (UPDATED) ---
-API_URL = "http://127.0.0.1:8000/v1/extract_items"
-IMAGE_PATH = "D:\\Internship Project -1\\ai-ocr_receipts\\images\\1.jpg"  # <-- IMPORTANT: Change this to the path of your test image
-API_KEY = "meallens@ocr"            # <-- Your new password
-API_KEY_NAME = "ocr-api"            # <-- Your new header name
 
 def call_receipt_api(image_path: str):
     """
     Sends an image to the protected API and prints the response.
     """
     print(f"Attempting to process image: {image_path}")
-
-    # 1. Set the required headers with the new API key and name
-    headers = {
-        API_KEY_NAME: API_KEY,
-        "accept": "application/json",
-    }
-
-    # 2. Open the image file in binary read mode
     try:
-        with open(image_path, "rb") as image_file:
-            files = {
-                "image": (image_file.name, image_file, "image/jpeg")
-            }
-
-            # 3. Send the POST request
+        with OcrClient(API_URL, api_key=API_KEY) as client:
             print("Sending request to API...")
-            response = requests.post(API_URL, headers=headers, files=files)
-
-            # 4. Check the response from the server
-            if response.status_code == 200:
-                print("\n✅ Success! API Response:")
-                print(json.dumps(response.json(), indent=2))
-            else:
-                print(f"\n❌ Error: Received status code {response.status_code}")
-                print("Response content:", response.text)
-
+            items = client.extract(image_path)
+        print("\n✅ Success! API Response:")
+        print(json.dumps(items, indent=2))
     except FileNotFoundError:
         print(f"\n❌ Error: The file was not found at path: {image_path}")
-    except requests.exceptions.RequestException as e:
+    except ApiError as e:
+        print(f"\n❌ Error: Received status code {e.status_code}")
+        print("Response content:", e.detail)
+    except httpx.HTTPError as e:
         print(f"\n❌ Error: A connection error occurred: {e}")
 
+
 if __name__ == "__main__":
-    call_receipt_api(IMAGE_PATH)
+    if len(sys.argv) != 2:
+        sys.exit("usage: python sample.py <receipt image>")
+    call_receipt_api(sys.argv[1])
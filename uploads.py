@@ -0,0 +1,424 @@
+# uploads.py
+
+import contextlib
+import io
+import os
+import tarfile
+import threading
+import zipfile
+import zlib
+
+from PIL import Image
+from starlette.exceptions import HTTPException
+from starlette.formparsers import MultiPartParser, parse_options_header
+from starlette.formparsers import multipart
+
+
+# --- Configuration ---
+# OCR_BATCH_MAX_IMAGES: most images accepted in one batch request, archives included.
+# OCR_MAX_UPLOAD_BYTES: largest single image accepted (bytes), whether uploaded
+#   directly or inside an archive.
+# OCR_MAX_REQUEST_BYTES: largest request body accepted by the batch and
+#   streaming endpoints, which may carry many images.
+# OCR_MAX_IMAGE_PIXELS: largest image (width x height) that will be decoded.
+#   Guards against decompression bombs: small files that decode to huge images.
+OCR_BATCH_MAX_IMAGES = int(os.environ.get("OCR_BATCH_MAX_IMAGES", 100))
+OCR_MAX_UPLOAD_BYTES = int(os.environ.get("OCR_MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+OCR_MAX_REQUEST_BYTES = int(os.environ.get("OCR_MAX_REQUEST_BYTES", 200 * 1024 * 1024))
+OCR_MAX_IMAGE_PIXELS = int(os.environ.get("OCR_MAX_IMAGE_PIXELS", 40_000_000))
+
+# PIL refuses to decode anything over twice this size
+Image.MAX_IMAGE_PIXELS = OCR_MAX_IMAGE_PIXELS
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Leading bytes of each accepted image format
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+}
+READ_CHUNK_SIZE = 64 * 1024
+# Room for multipart boundaries and form fields around a single image
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Starlette moves an uploaded file from memory to a temporary file once it
+# passes this size (1 MB by default, less than most phone photos). Any single
+# image within the upload limit stays in memory; only larger batch archives
+# are spooled to disk.
+MultiPartParser.spool_max_size = OCR_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD
+
+
+class TooManyImages(Exception):
+    """Raised when a batch holds more images than OCR_BATCH_MAX_IMAGES."""
+
+
+class UploadTooLarge(Exception):
+    """Raised for images or requests over the size limits; maps to HTTP 413."""
+
+
+class UnsupportedImageType(Exception):
+    """Raised for uploads that are not JPEG or PNG images; maps to HTTP 415."""
+
+
+class InvalidArchive(Exception):
+    """Raised for zip/tar uploads that are truncated or corrupt."""
+
+
+# What reading a damaged zip, tar or compressed tar can raise
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error)
+
+
+def sniff_image_type(head):
+    """Returns "JPEG" or "PNG" from the first bytes of a file, or None."""
+    for signature, kind in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+def _too_large(size, max_bytes):
+    return UploadTooLarge(f"The image is {size} bytes; the limit is {max_bytes} bytes.")
+
+
+async def read_upload(upload, max_bytes=OCR_MAX_UPLOAD_BYTES):
+    """
+    Reads an UploadFile in chunks and returns its bytes, checking the
+    JPEG/PNG signature first and stopping once the size limit is passed.
+    By now the request body has been received; uploads to the single-image
+    endpoints were already screened as they arrived (ImageSignatureMiddleware).
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise _too_large(upload.size, max_bytes)
+    head = await upload.read(READ_CHUNK_SIZE)
+    if sniff_image_type(head) is None:
+        raise UnsupportedImageType("Only JPEG and PNG images are supported.")
+    buf = bytearray(head)
+    while True:
+        chunk = await upload.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return bytes(buf)
+        buf += chunk
+        if len(buf) > max_bytes:
+            raise _too_large(f"over {max_bytes}", max_bytes)
+
+
+def check_image(contents, max_pixels=OCR_MAX_IMAGE_PIXELS):
+    """
+    Validates image bytes from their header alone, without decoding any
+    pixels: the format must be JPEG or PNG and the image at most
+    `max_pixels` large. Raises UnsupportedImageType or UploadTooLarge.
+    """
+    if sniff_image_type(contents[:16]) is None:
+        raise UnsupportedImageType("Only JPEG and PNG images are supported.")
+    try:
+        with Image.open(io.BytesIO(contents)) as img:
+            width, height = img.size
+    except Image.DecompressionBombError:
+        raise UploadTooLarge(f"The image has more than {max_pixels} pixels.")
+    except Exception:
+        raise UnsupportedImageType("The image could not be read; it may be corrupt.")
+    if width * height > max_pixels:
+        raise UploadTooLarge(
+            f"The image is {width}x{height} pixels; the limit is {max_pixels} pixels."
+        )
+
+
+def is_image_name(name):
+    base = os.path.basename(name)
+    # Skip hidden files and the resource forks macOS adds to zip files
+    if not base or base.startswith(".") or name.startswith("__MACOSX/"):
+        return False
+    return base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def open_archive(fileobj):
+    """
+    Returns ("zip", ZipFile) or ("tar", TarFile) if fileobj is an archive,
+    otherwise None with the file position restored. May raise one of
+    ARCHIVE_ERRORS for a damaged zip file.
+    """
+    start = fileobj.tell()
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(start)
+        return "zip", zipfile.ZipFile(fileobj)
+    fileobj.seek(start)
+    try:
+        # Left where it is on success: a compressed tar's decompressor
+        # carries on from the current position
+        return "tar", tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.TarError:
+        fileobj.seek(start)
+        return None
+
+
+def iter_archive_images(kind, archive):
+    """
+    Yields (name, reader) for each image in an archive, in archive order.
+    `reader()` returns the member bytes, so members are only decompressed
+    when the caller gets to them. Readers may run in other threads, also
+    while iteration continues.
+    """
+    if kind == "zip":
+        # ZipFile supports reading members from several threads at once
+        for info in archive.infolist():
+            if not info.is_dir() and is_image_name(info.filename):
+                yield info.filename, (lambda info=info: _read_member(info.file_size, lambda: archive.open(info)))
+    else:
+        # A TarFile reads everything through one file position, so listing
+        # and reading members take turns
+        lock = threading.Lock()
+        while True:
+            with lock:
+                member = archive.next()
+            if member is None:
+                return
+            if member.isfile() and is_image_name(member.name):
+                yield member.name, (lambda member=member: _read_member(
+                    member.size, lambda: archive.extractfile(member), lock=lock
+                ))
+
+
+def iter_batch_images(uploads, max_images=OCR_BATCH_MAX_IMAGES):
+    """
+    Flattens a list of UploadFile objects into (filename, reader) pairs.
+
+    Plain images are passed through; zip and tar archives are expanded into
+    the images they contain. An archive that turns out to be damaged gives
+    one more entry, named after the upload, whose reader raises
+    InvalidArchive. Raises TooManyImages once more than `max_images` images
+    have been seen; pass max_images=None for no limit.
+    """
+    count = 0
+    for upload in uploads:
+        try:
+            archive = open_archive(upload.file)
+            if archive is None:
+                entries = [(upload.filename, lambda upload=upload: _read_all(upload.file))]
+            else:
+                entries = iter_archive_images(*archive)
+            for name, reader in entries:
+                count += 1
+                if max_images is not None and count > max_images:
+                    raise TooManyImages(f"A batch may contain at most {max_images} images.")
+                yield name, reader
+        except ARCHIVE_ERRORS as e:
+            count += 1
+            if max_images is not None and count > max_images:
+                raise TooManyImages(f"A batch may contain at most {max_images} images.")
+            error = InvalidArchive(f"The archive is truncated or corrupt: {e}")
+            yield upload.filename, lambda error=error: _raise(error)
+
+
+def _raise(error):
+    raise error
+
+
+def _read_member(size, open_member, max_bytes=OCR_MAX_UPLOAD_BYTES, lock=None):
+    # Sizes in archive headers can lie, so the read itself is capped too
+    if size > max_bytes:
+        raise _too_large(size, max_bytes)
+    with lock or contextlib.nullcontext(), open_member() as f:
+        data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise _too_large(f"over {max_bytes}", max_bytes)
+    return data
+
+
+def _read_all(fileobj, max_bytes=OCR_MAX_UPLOAD_BYTES):
+    fileobj.seek(0)
+    data = fileobj.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise _too_large(f"over {max_bytes}", max_bytes)
+    return data
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware rejecting request bodies over a size limit with 413.
+
+    FastAPI parses the whole multipart body before an endpoint runs, so the
+    limit has to be enforced here: requests that announce a larger
+    Content-Length are refused before their body is read, and chunked
+    bodies are cut off as soon as they pass the limit. `path_limits`
+    overrides `max_bytes` for specific paths.
+    """
+
+    def __init__(self, app, max_bytes=OCR_MAX_REQUEST_BYTES, path_limits=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.path_limits.get(scope["path"], self.max_bytes)
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > limit:
+                    await self._reject(send, limit)
+                    return
+                break
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _BodyTooLarge(limit)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except _BodyTooLarge:
+            if response_started:
+                raise
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit):
+        body = f'{{"detail":"Request body too large; the limit is {limit} bytes."}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class _BodyTooLarge(HTTPException):
+    # An HTTPException, because FastAPI turns any other error raised while
+    # parsing the body into a 400
+    def __init__(self, limit):
+        super().__init__(status_code=413, detail=f"Request body too large; the limit is {limit} bytes.")
+
+
+class ImageSignatureMiddleware:
+    """
+    ASGI middleware rejecting uploads to the single-image endpoints (`paths`)
+    with 415 as soon as the first bytes of the file arrive, if they are not
+    a JPEG or PNG signature. FastAPI only calls an endpoint once the whole
+    multipart body has been received, so without this a wrong file would be
+    uploaded in full before being refused.
+
+    The body is run through a multipart parser as FastAPI reads it, until
+    the first file part has been checked; malformed bodies are left for
+    FastAPI to report.
+    """
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        content_type = b""
+        for name, value in scope["headers"]:
+            if name == b"content-type":
+                content_type = value
+                break
+        kind, params = parse_options_header(content_type)
+        if kind != b"multipart/form-data" or b"boundary" not in params:
+            await self.app(scope, receive, send)
+            return
+
+        parser = None
+        header_name = bytearray()
+        header_value = bytearray()
+        disposition = b""
+        head = None  # start of the file part being checked
+
+        def on_header_field(data, start, end):
+            header_name.extend(data[start:end])
+
+        def on_header_value(data, start, end):
+            header_value.extend(data[start:end])
+
+        def on_header_end():
+            nonlocal disposition
+            if header_name.lower() == b"content-disposition":
+                disposition = bytes(header_value)
+            header_name.clear()
+            header_value.clear()
+
+        def on_headers_finished():
+            nonlocal head, disposition
+            if b"filename" in parse_options_header(disposition)[1]:
+                head = bytearray()
+            disposition = b""
+
+        def on_part_data(data, start, end):
+            if head is not None:
+                head.extend(data[start:min(end, start + 16)])
+                if len(head) >= 8:
+                    check()
+
+        def on_part_end():
+            if head is not None:
+                check()
+
+        def check():
+            nonlocal parser, head
+            kind = sniff_image_type(bytes(head))
+            parser, head = None, None
+            if kind is None:
+                raise _UnsupportedUpload()
+
+        parser = multipart.MultipartParser(params[b"boundary"], {
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        })
+        response_started = False
+
+        async def sniffing_receive():
+            nonlocal parser
+            message = await receive()
+            if parser is not None and message["type"] == "http.request":
+                try:
+                    parser.write(message.get("body", b""))
+                except _UnsupportedUpload:
+                    raise
+                except Exception:
+                    parser = None
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, sniffing_receive, tracking_send)
+        except _UnsupportedUpload as e:
+            if response_started:
+                raise
+            body = f'{{"detail":"{e.detail}"}}'.encode()
+            await send({
+                "type": "http.response.start",
+                "status": 415,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+
+
+class _UnsupportedUpload(HTTPException):
+    # An HTTPException for the same reason as _BodyTooLarge
+    def __init__(self):
+        super().__init__(status_code=415, detail="Only JPEG and PNG images are supported.")